@@ -0,0 +1,208 @@
+import mmap
+import struct
+import sys
+from array import array
+
+# Compiled automaton file (.abcb), all integers little-endian:
+#   header       magic, version, kind, n_states, n_symbols, n_transitions, init state
+#   states       u32 byte length + state names joined by '\n' (UTF-8)
+#   symbols      u32 byte length + symbol names joined by '\n' (UTF-8)
+#   accepting    one byte per state, padded to a multiple of 4
+#   DFA body     n_states x n_symbols int32 table, -1 for a missing transition
+#   NFA body     n_transitions x (from, symbol, to) uint32 triples
+# The bodies are used straight out of the memory map, without copying.
+
+MAGIC = b"ABCB"
+VERSION = 1
+EXTENSION = ".abcb"
+KINDS = {"dfa": 0, "nfa": 1}
+HEADER = struct.Struct("<4sHBBIIII")
+DEAD = -1
+
+
+def is_binary(fname):
+    try:
+        with open(fname, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _names(names):
+    data = "\n".join(names).encode("utf-8")
+    return struct.pack("<I", len(data)) + data
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class TransitionView:
+    # Read-only sequence of (from, symbol, to) name tuples over the mapped body,
+    # so code written for the text format can still iterate transitions.
+
+    __slots__ = ("_machine", "_cells")
+
+    def __init__(self, machine):
+        self._machine = machine
+        self._cells = None
+
+    def _dfa_cells(self):
+        if self._cells is None:
+            table = self._machine["table"]
+            self._cells = array('l', (cell for cell in range(len(table)) if table[cell] != DEAD))
+        return self._cells
+
+    def __len__(self):
+        if "table" in self._machine:
+            return len(self._dfa_cells())
+        return len(self._machine["flat"]) // 3
+
+    def __getitem__(self, i):
+        machine = self._machine
+        states, symbols = machine["states"], machine["symbols"]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if "table" in machine:
+            cell = self._dfa_cells()[i]
+            state, sym = divmod(cell, machine["n_symbols"])
+            return states[state], symbols[sym], states[machine["table"][cell]]
+        flat = machine["flat"]
+        if not 0 <= i < len(flat) // 3:
+            raise IndexError("transition index out of range")
+        return states[flat[3 * i]], symbols[flat[3 * i + 1]], states[flat[3 * i + 2]]
+
+    def __iter__(self):
+        machine = self._machine
+        states, symbols = machine["states"], machine["symbols"]
+        if "table" in machine:
+            table, n_symbols = machine["table"], machine["n_symbols"]
+            for cell in range(len(table)):
+                if table[cell] != DEAD:
+                    yield states[cell // n_symbols], symbols[cell % n_symbols], states[table[cell]]
+        else:
+            flat = machine["flat"]
+            for i in range(0, len(flat), 3):
+                yield states[flat[i]], symbols[flat[i + 1]], states[flat[i + 2]]
+
+
+def save(machine, fname, kind):
+    if kind not in KINDS:
+        print(f"Error: Cannot save a '{kind}' in binary form.")
+        return False
+    states, symbols = list(machine["states"]), list(machine["symbols"])
+    state_index = {state: i for i, state in enumerate(states)}
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    accepting = bytearray(len(states))
+    for state in machine["fin_states"]:
+        accepting[state_index[state]] = 1
+    accepting += bytes(-len(accepting) % 4)
+
+    if kind == "dfa":
+        body = array('i', [DEAD]) * (len(states) * len(symbols))
+        n_transitions = 0
+        for t in machine["transitions"]:
+            cell = state_index[t[0]] * len(symbols) + symbol_index[t[1]]
+            if body[cell] == DEAD:
+                body[cell] = state_index[t[2]]
+                n_transitions += 1
+    else:
+        body = array('I')
+        for t in machine["transitions"]:
+            body.extend((state_index[t[0]], symbol_index[t[1]], state_index[t[2]]))
+        n_transitions = len(body) // 3
+
+    header = HEADER.pack(MAGIC, VERSION, KINDS[kind], 0, len(states), len(symbols), n_transitions,
+                         state_index[machine["init_state"]])
+    names = _names(states) + _names(symbols)
+    with open(fname, 'wb') as f:
+        f.write(header)
+        f.write(names)
+        f.write(bytes(-(len(header) + len(names)) % 4))
+        f.write(accepting)
+        f.write(_little_endian(body))
+    return True
+
+
+def load(fname):
+    with open(fname, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if len(view) < HEADER.size:
+        print(f"Error: '{fname}' is too short to be a compiled automaton.")
+        return None
+    magic, version, kind, _, n_states, n_symbols, n_transitions, init = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION or kind not in KINDS.values():
+        print(f"Error: '{fname}' is not a compiled automaton this version can read.")
+        return None
+    if sys.byteorder != "little":
+        print(f"Error: '{fname}' can only be memory-mapped on little-endian machines.")
+        return None
+
+    def truncated():
+        print(f"Error: '{fname}' is truncated.")
+
+    offset = HEADER.size
+    tables = []
+    for count in (n_states, n_symbols):
+        if len(view) < offset + 4:
+            return truncated()
+        (length,) = struct.unpack_from("<I", view, offset)
+        offset += 4
+        if len(view) < offset + length:
+            return truncated()
+        names = bytes(view[offset:offset + length]).decode("utf-8")
+        offset += length
+        tables.append(names.split("\n") if count else [])
+    states, symbols = tables
+    offset += -offset % 4
+    if len(view) < offset + n_states:
+        return truncated()
+    accepting = view[offset:offset + n_states]
+    offset += n_states + (-n_states % 4)
+
+    if len(states) != n_states or len(symbols) != n_symbols or init >= max(n_states, 1):
+        print(f"Error: '{fname}' has an inconsistent header.")
+        return None
+
+    machine = {
+        "kind": "dfa" if kind == KINDS["dfa"] else "nfa",
+        "states": states,
+        "symbols": symbols,
+        "init_state": states[init],
+        "fin_states": [state for i, state in enumerate(states) if accepting[i]],
+        # Indices were checked when the file was written.
+        "validated": True,
+    }
+    body_size = n_states * n_symbols * 4 if kind == KINDS["dfa"] else n_transitions * 12
+    if len(view) < offset + body_size:
+        return truncated()
+    if kind == KINDS["dfa"]:
+        machine["table"] = view[offset:offset + body_size].cast('i')
+        machine["state_index"] = {state: i for i, state in enumerate(states)}
+        machine["symbol_index"] = {symbol: i for i, symbol in enumerate(symbols)}
+        machine["n_symbols"] = n_symbols
+        machine["accepting"] = accepting
+        machine["init"] = init
+    else:
+        machine["flat"] = view[offset:offset + body_size].cast('I')
+    machine["transitions"] = TransitionView(machine)
+    return machine
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in KINDS:
+        print("Usage: python abcbin.py dfa|nfa input.abc output.abcb")
+        sys.exit(2)
+    import dfa
+    import nfa
+    prep, check = (dfa.prep_dfa, dfa.check_dfa) if sys.argv[1] == "dfa" else (nfa.prep_nfa, nfa.check_nfa)
+    automaton = prep(sys.argv[2])
+    if automaton is None or not check(automaton):
+        sys.exit(1)
+    sys.exit(0 if save(automaton, sys.argv[3], sys.argv[1]) else 1)
@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+import abcbin
+import cfg
+import dfa
+import lazydfa
+import nfa
+import pda
+import turing
+
+
+def load_machine(kind, fname, cache_states=10000):
+    if kind == "dfa":
+        return dfa.load_dfa(fname)
+    if kind == "nfa":
+        return nfa.load_nfa(fname)
+    if kind == "lazy-nfa":
+        machine = load_machine("nfa", fname)
+        return lazydfa.make_lazy_dfa(machine, max_states=cache_states) if machine is not None else None
+    if kind == "pda":
+        return pda.load_pda(fname)
+    if kind == "cfg":
+        return cfg.load_grammar(fname)
+    if kind == "tm":
+        return turing.load_turing(fname)
+    print(f"Error: Unknown machine type '{kind}'.")
+    return None
+
+
+def score(kind, machine, line, max_steps=1000, max_time=None, detect_loops=False):
+    tokens = line.split()
+    if kind == "tm":
+        band, state, verdict = turing.simulate(machine, tokens, max_steps=max_steps, max_time=max_time,
+                                               detect_loops=detect_loops)
+        return {"input": line, "accepted": verdict == "ACCEPTED", "verdict": verdict,
+                "state": state, "band": " ".join(band) if band is not None else None}
+    if kind == "pda":
+        verdict = pda.verdict(machine, tokens)
+        return {"input": line, "accepted": verdict == "ACCEPTED", "verdict": verdict}
+    if kind == "dfa":
+        accepted = dfa.accepts(machine, tokens)
+    elif kind == "nfa":
+        accepted = nfa.accepts(machine, tokens)
+    elif kind == "lazy-nfa":
+        accepted = lazydfa.accepts(machine, tokens)
+    else:
+        accepted = cfg.accepts(machine, tokens)
+    return {"input": line, "accepted": accepted, "verdict": "ACCEPTED" if accepted else "REJECTED"}
+
+
+PENDING_PER_JOB = 2
+_worker = {}
+
+
+def _init_worker(kind, machine, max_steps, definition=None, cache_states=10000, max_time=None, detect_loops=False):
+    if machine is None:
+        # Memory-mapped definitions cannot be pickled; each worker maps the file itself.
+        with contextlib.redirect_stdout(io.StringIO()):
+            machine = load_machine(kind, definition, cache_states)
+    _worker["kind"] = kind
+    _worker["machine"] = machine
+    _worker["max_steps"] = max_steps
+    _worker["max_time"] = max_time
+    _worker["detect_loops"] = detect_loops
+
+
+def _score_chunk(lines):
+    kind, machine, max_steps = _worker["kind"], _worker["machine"], _worker["max_steps"]
+    max_time, detect_loops = _worker["max_time"], _worker["detect_loops"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [score(kind, machine, line, max_steps, max_time, detect_loops) for line in lines]
+
+
+def _score_chunk_vectorized(lines):
+    machine = _worker["machine"]
+    accepted = dfa.accepts_batch(machine, dfa.encode_batch(machine, [line.split() for line in lines]))
+    return [{"input": line, "accepted": bool(ok), "verdict": "ACCEPTED" if ok else "REJECTED"}
+            for line, ok in zip(lines, accepted)]
+
+
+def read_lines(stream):
+    for line in stream:
+        yield line.rstrip("\r\n")
+
+
+def chunked(lines, size):
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bounded_imap(pool, func, items, window):
+    # Like pool.imap, in order, but at most `window` items are in flight, so
+    # the input is read only as fast as results are written.
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def run_batch(kind, machine, lines, out, jobs=1, chunk_size=1000, max_steps=1000, vectorized=False,
+              definition=None, cache_states=10000, max_time=None, detect_loops=False):
+    total = 0
+    accepted = 0
+    scorer = _score_chunk_vectorized if vectorized else _score_chunk
+    if jobs > 1:
+        shared = None if definition is not None and abcbin.is_binary(definition) else machine
+        initargs = (kind, shared, max_steps, definition, cache_states, max_time, detect_loops)
+        with Pool(jobs, initializer=_init_worker, initargs=initargs) as pool:
+            for verdicts in bounded_imap(pool, scorer, chunked(lines, chunk_size), PENDING_PER_JOB * jobs):
+                for verdict in verdicts:
+                    out.write(json.dumps(verdict) + "\n")
+                    total += 1
+                    accepted += verdict["accepted"]
+    else:
+        _init_worker(kind, machine, max_steps, max_time=max_time, detect_loops=detect_loops)
+        for chunk in chunked(lines, chunk_size):
+            for verdict in scorer(chunk):
+                out.write(json.dumps(verdict) + "\n")
+                total += 1
+                accepted += verdict["accepted"]
+    return total, accepted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch",
+                                     description="Score input strings against an automaton, one JSONL verdict per line.")
+    parser.add_argument("kind", choices=["dfa", "nfa", "pda", "tm"])
+    parser.add_argument("definition", help="the .abc (or compiled .abcb) file describing the machine")
+    parser.add_argument("-i", "--input", help="file with one space-separated input string per line (default: stdin)")
+    parser.add_argument("-o", "--output", help="where to write the JSONL verdicts (default: stdout)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="strings sent to a worker at a time")
+    parser.add_argument("--max-steps", type=int, default=1000, help="step limit for Turing machines")
+    parser.add_argument("--max-time", type=float, help="time limit in seconds per string for Turing machines")
+    parser.add_argument("--detect-loops", action="store_true",
+                        help="report Turing machines that revisit a configuration as LOOPING")
+    parser.add_argument("--vectorized", action="store_true", help="score DFA chunks with numpy in lockstep")
+    parser.add_argument("--lazy", action="store_true", help="match NFAs through a lazily built, bounded DFA cache")
+    parser.add_argument("--cache-states", type=int, default=10000, help="DFA states kept by --lazy")
+    parser.add_argument("--grammar", action="store_true",
+                        help="decide PDA membership by converting it to a grammar and chart parsing")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only write verdicts, no diagnostics")
+    args = parser.parse_args(argv)
+    if args.vectorized and (args.kind != "dfa" or dfa.np is None):
+        print("Error: --vectorized needs a DFA and numpy installed.", file=sys.stderr)
+        return 1
+    if args.lazy and args.kind != "nfa":
+        print("Error: --lazy only applies to NFAs.", file=sys.stderr)
+        return 1
+
+    if args.grammar and args.kind != "pda":
+        print("Error: --grammar only applies to PDAs.", file=sys.stderr)
+        return 1
+
+    kind = "lazy-nfa" if args.lazy else "cfg" if args.grammar else args.kind
+    log = io.StringIO() if args.quiet else sys.stderr
+    with contextlib.redirect_stdout(log):
+        try:
+            machine = load_machine(kind, args.definition, args.cache_states)
+        except OSError as error:
+            print(f"Error: {error.strerror}.")
+            machine = None
+    if machine is None:
+        if args.quiet:
+            sys.stderr.write(log.getvalue())
+        print(f"Error: Could not load {args.kind} from '{args.definition}'.", file=sys.stderr)
+        return 1
+
+    source = open(args.input, "r") if args.input else sys.stdin
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        total, accepted = run_batch(kind, machine, read_lines(source), out,
+                                    jobs=args.jobs, chunk_size=args.chunk_size, max_steps=args.max_steps,
+                                    vectorized=args.vectorized, definition=args.definition,
+                                    cache_states=args.cache_states, max_time=args.max_time,
+                                    detect_loops=args.detect_loops)
+    finally:
+        if args.input:
+            source.close()
+        if args.output:
+            out.close()
+
+    if not args.quiet:
+        print(f"Processed {total} strings, {accepted} accepted.", file=sys.stderr)
+        if args.lazy and args.jobs <= 1:
+            stats = lazydfa.cache_stats(_worker["machine"])
+            print(f"Lazy DFA cache: {stats['states']} states, {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['evictions']} evictions, {stats['fallbacks']} fallbacks.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+# On-disk cache of parsed, validated and compiled automata. Entries are keyed by
+# the definition file's contents, the machine type and a digest of the code that
+# builds them, so editing either the file or the parser invalidates them.
+
+TOOL_VERSION = "1"
+CACHE_DIR = os.environ.get("CS112_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "cs112")
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+SOURCES = ["prep.py", "model.py", "dfa.py", "nfa.py", "pda.py", "turing.py", "cfg.py", "validate.py", "cache.py"]
+
+_code_digest = None
+
+
+def enabled():
+    return os.environ.get("CS112_NO_CACHE", "") in ("", "0")
+
+
+def code_digest():
+    global _code_digest
+    if _code_digest is None:
+        digest = hashlib.sha256(TOOL_VERSION.encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in SOURCES:
+            path = os.path.join(here, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(name.encode() + b"\0" + f.read())
+        _code_digest = digest.hexdigest()
+    return _code_digest
+
+
+def file_digest(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def entry_path(fname, kind):
+    key = hashlib.sha256(f"{kind}\0{file_digest(fname)}\0{code_digest()}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, key + ".pickle")
+
+
+def load_cached(fname, kind, build):
+    if not enabled():
+        return build(fname)
+    try:
+        path = entry_path(fname, kind)
+    except OSError:
+        return build(fname)
+
+    try:
+        with open(path, 'rb') as f:
+            machine = pickle.load(f)
+        os.utime(path)
+        return machine
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # A truncated or stale entry is simply rebuilt.
+        discard(path)
+
+    machine = build(fname)
+    if machine is not None:
+        store(path, machine)
+    return machine
+
+
+def store(path, machine):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(machine, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        # Memory-mapped machines cannot be pickled; they load quickly anyway.
+        discard(tmp)
+        return
+    evict()
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def evict(limit=None):
+    limit = MAX_CACHE_BYTES if limit is None else limit
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        discard(path)
+        total -= size
+
+
+def clear():
+    evict(0)
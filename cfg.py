@@ -0,0 +1,193 @@
+import sys
+
+import cache
+import pda as pda_module
+
+# PDA membership through an equivalent context-free grammar. The PDA is first
+# normalised so the triple construction applies: a bottom marker stands in for
+# the empty stack, pushes longer than two symbols go through fresh states, and
+# a drain state empties the stack from every accept state once the input is
+# read. Nonterminal (p, X, r) derives exactly the words that take the machine
+# from p with X on top to r with that X popped. Membership is then decided by
+# an Earley parser, O(n^3) in the input length however ambiguous the PDA is.
+#
+# Terminals are input symbols (strings); nonterminals are tuples.
+
+START = ("start",)
+BOTTOM = ("bottom",)
+DRAIN = ("drain",)
+
+
+def normalize(pda):
+    # Returns the states, stack symbols and (state, top, symbol, next_state,
+    # push) moves of an equivalent PDA that accepts by empty stack, where every
+    # move pops exactly one symbol and pushes at most two (push[0] on top).
+    stack = list(pda["stack"]) + [BOTTOM]
+    states = list(pda["states"]) + [DRAIN]
+    moves = []
+    for n, (ti, expected_stack_top, sym, to, stack_push) in enumerate(pda["transitions"]):
+        push = tuple(s for s in stack_push if s != "epsilon")
+        if expected_stack_top == "epsilon":
+            # Fires on an empty stack: here that is the bottom marker, kept in place.
+            expected_stack_top, push = BOTTOM, push + (BOTTOM,)
+        if len(push) <= 2:
+            moves.append((ti, expected_stack_top, sym, to, push))
+            continue
+        # Push the symbols bottom first, two at a time, through fresh states.
+        chain = [("push", n, step) for step in range(1, len(push))]
+        states.extend(chain)
+        moves.append((ti, expected_stack_top, sym, chain[0], (push[-1],)))
+        for step in range(1, len(push) - 1):
+            moves.append((chain[step - 1], push[-step], "epsilon", chain[step], (push[-step - 1], push[-step])))
+        moves.append((chain[-1], push[1], "epsilon", to, (push[0], push[1])))
+    for state in list(pda["fin_states"]) + [DRAIN]:
+        for top in stack:
+            moves.append((state, top, "epsilon", DRAIN, ()))
+    return states, stack, moves
+
+
+def pda_to_grammar(pda):
+    states, stack, moves = normalize(pda)
+    by_top = {}
+    for ti, top, sym, to, push in moves:
+        by_top.setdefault((ti, top), []).append((() if sym == "epsilon" else (sym,), to, push))
+
+    productions = {START: [((pda["init_state"], BOTTOM, DRAIN),)]}
+    pending = [(pda["init_state"], BOTTOM, DRAIN)]
+    while pending:
+        head = pending.pop()
+        if head in productions:
+            continue
+        p, top, r = head
+        bodies = []
+        for read, to, push in by_top.get((p, top), ()):
+            if not push:
+                if to == r:
+                    bodies.append(read)
+            elif len(push) == 1:
+                bodies.append(read + ((to, push[0], r),))
+            else:
+                for m in states:
+                    bodies.append(read + ((to, push[0], m), (m, push[1], r)))
+        productions[head] = bodies
+        for body in bodies:
+            pending.extend(s for s in body if isinstance(s, tuple) and s not in productions)
+    productions = trim(productions)
+    return {
+        "start": START,
+        "productions": productions,
+        "nullable": nullable(productions),
+        "terminals": {s for bodies in productions.values() for body in bodies for s in body if isinstance(s, str)},
+    }
+
+
+def trim(productions):
+    # Drops nonterminals that derive no terminal string, then those the start
+    # symbol no longer reaches.
+    productive = set()
+    changed = True
+    while changed:
+        changed = False
+        for head, bodies in productions.items():
+            if head not in productive and any(all(isinstance(s, str) or s in productive for s in body)
+                                              for body in bodies):
+                productive.add(head)
+                changed = True
+    useful = {head: [body for body in bodies if all(isinstance(s, str) or s in productive for s in body)]
+              for head, bodies in productions.items() if head in productive}
+    reached = {START} if START in useful else set()
+    pending = list(reached)
+    while pending:
+        for body in useful[pending.pop()]:
+            for s in body:
+                if isinstance(s, tuple) and s not in reached:
+                    reached.add(s)
+                    pending.append(s)
+    return {head: bodies for head, bodies in useful.items() if head in reached}
+
+
+def nullable(productions):
+    result = set()
+    changed = True
+    while changed:
+        changed = False
+        for head, bodies in productions.items():
+            if head not in result and any(all(s in result for s in body) for body in bodies):
+                result.add(head)
+                changed = True
+    return result
+
+
+def earley(grammar, tokens):
+    productions, empty, start = grammar["productions"], grammar["nullable"], grammar["start"]
+    n = len(tokens)
+    chart = [set() for _ in range(n + 1)]
+    waiting = [{} for _ in range(n + 1)]
+
+    for i in range(n + 1):
+        items = chart[i]
+        agenda = list(items)
+
+        def add(item):
+            if item not in items:
+                items.add(item)
+                agenda.append(item)
+
+        if i == 0:
+            for body in productions.get(start, ()):
+                add((start, body, 0, 0))
+        while agenda:
+            item = agenda.pop()
+            head, body, dot, origin = item
+            if dot < len(body):
+                symbol = body[dot]
+                if isinstance(symbol, tuple):
+                    waiting[i].setdefault(symbol, []).append(item)
+                    for production in productions.get(symbol, ()):
+                        add((symbol, production, 0, i))
+                    # Aycock-Horspool: step over nullable symbols right away.
+                    if symbol in empty:
+                        add((head, body, dot + 1, origin))
+                elif i < n and symbol == tokens[i]:
+                    chart[i + 1].add((head, body, dot + 1, origin))
+            else:
+                for w_head, w_body, w_dot, w_origin in waiting[origin].get(head, ()):
+                    add((w_head, w_body, w_dot + 1, w_origin))
+        if i < n and not chart[i + 1]:
+            return False
+    return any(head == start and dot == len(body) and origin == 0 for head, body, dot, origin in chart[n])
+
+
+def accepts(grammar, tokens):
+    if any(symbol not in grammar["terminals"] for symbol in tokens):
+        return False
+    return earley(grammar, tokens)
+
+
+def build_grammar(fpda):
+    pda = pda_module.build_pda(fpda)
+    if pda is None:
+        return None
+    return pda_to_grammar(pda)
+
+
+def load_grammar(fpda):
+    return cache.load_cached(fpda, "cfg", build_grammar)
+
+
+def show(symbol):
+    if isinstance(symbol, str):
+        return symbol
+    return "[" + " ".join(part if isinstance(part, str) else "_".join(map(str, part)) for part in symbol) + "]"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python cfg.py pda.abc")
+        sys.exit(2)
+    grammar = load_grammar(sys.argv[1])
+    if grammar is None:
+        sys.exit(1)
+    for head, bodies in grammar["productions"].items():
+        for body in bodies:
+            print(f"{show(head)} -> {' '.join(show(s) for s in body) or 'epsilon'}")
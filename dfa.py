@@ -1,4 +1,18 @@
+import os
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import abcbin
+import cache
+import model
 import prep
+import validate
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 def prep_symbols(fsymbols):
     symbols = []
@@ -21,7 +35,7 @@ def prep_states(fstates):
                 if init_state==None:
                     init_state = st
                 else:
-                    print(f"Error: Multiple initial states found: {init_state} and {st}.")
+                    print(f"Error: Multiple initial states found: {init_state} and {st}{prep.where(state)}.")
                     return None
             elif tip == 'accept':
                 fin_states.append(st)
@@ -34,55 +48,56 @@ def prep_states(fstates):
 
     return states, init_state, fin_states
 
-def prep_transitions(ftransitions):
-    transitions = []
+def prep_transitions(ftransitions, dfa=None):
+    if dfa is None:
+        dfa = model.Automaton("dfa")
+    dfa.setdefault("transitions", [])
     for transition in ftransitions:
         try:
             inp, rez = transition.split('>')
             in_state, symbol = inp.split('+')
-            transitions.append((in_state.strip(), symbol.strip(), rez.strip()))
+            dfa.add_transition((in_state.strip(), symbol.strip(), rez.strip()), getattr(transition, "lineno", 0))
         except ValueError:
-            print(f"Error: Invalid transition format: {transition}")
+            print(f"Error: Invalid transition format: {transition}{prep.where(transition)}")
             return None
-    return transitions
+    return dfa["transitions"]
 
 def prep_dfa(fdfa):
-    files=prep.prep_file(fdfa)
-    if not files:
+    if abcbin.is_binary(fdfa):
+        dfa = abcbin.load(fdfa)
+        if dfa is not None and dfa["kind"] != "dfa":
+            print(f"Error: '{fdfa}' holds an NFA, not a DFA.")
+            return None
+        return dfa
+    dfa=model.Automaton("dfa")
+    files={}
+    for cap, lines in prep.iter_sections(fdfa):
+        if cap.upper()=="TRANSITIONS":
+            if prep_transitions(lines, dfa) is None:
+                return None
+        else:
+            files.setdefault(cap, []).extend(lines)
+    if not files and not dfa:
         print("Error: No data found in the file.")
         return None
-    dfa={}
     for cap in files.keys():
         if cap.upper()=="SYMBOLS":
-            dfa["symbols"] = prep_symbols(files[cap])
-            if dfa["symbols"] is None:
+            symbols = prep_symbols(files[cap])
+            if symbols is None:
                 return None
+            dfa["symbols"] = symbols
         elif cap.upper()=="STATES":
-            states, init_state, fin_states = prep_states(files[cap])
-            if states is None:
+            result = prep_states(files[cap])
+            if result is None:
                 return None
+            states, init_state, fin_states = result
             dfa["states"] = states
             dfa["init_state"] = init_state
             dfa["fin_states"] = fin_states
-        elif cap.upper()=="TRANSITIONS":
-            dfa["transitions"] = prep_transitions(files[cap])
-            if dfa["transitions"] is None:
-                return None
     return dfa
 
 def check_dfa(dfa):
-    for t in dfa["transitions"]:
-        if t[0] not in dfa["states"]:
-            print(f"Error: Transition from non-existing state {t[0]}.")
-            return False
-        if t[1] not in dfa["symbols"]:
-            print(dfa["symbols"],t[1])
-            print(f"Error: Transition with non-existing symbol {t[1]}.")
-            return False
-        if t[2] not in dfa["states"]:
-            print(f"Error: Transition to non-existing state {t[2]}.")
-            return False
-    return True
+    return validate.check(dfa, "dfa")
 
 def next_state(dfa, current_state, symbol):
     for t in dfa["transitions"]:
@@ -90,9 +105,344 @@ def next_state(dfa, current_state, symbol):
             return t[2]
     return None
 
+DEAD = -1
+
+def compile_dfa(dfa):
+    # States and symbols become indices; transitions become a dense
+    # state x symbol -> state table with DEAD for missing transitions.
+    if "table" in dfa:
+        return dfa
+    state_index = {state: i for i, state in enumerate(dfa["states"])}
+    symbol_index = {symbol: i for i, symbol in enumerate(dfa["symbols"])}
+    n_symbols = len(dfa["symbols"])
+    table = array('l', [DEAD]) * (len(dfa["states"]) * n_symbols)
+    for t in dfa["transitions"]:
+        cell = state_index[t[0]] * n_symbols + symbol_index[t[1]]
+        # Same as next_state: the first matching transition wins.
+        if table[cell] == DEAD:
+            table[cell] = state_index[t[2]]
+    accepting = bytearray(len(dfa["states"]))
+    for state in dfa["fin_states"]:
+        accepting[state_index[state]] = 1
+    compiled = dict(dfa)
+    compiled["state_index"] = state_index
+    compiled["symbol_index"] = symbol_index
+    compiled["n_symbols"] = n_symbols
+    compiled["table"] = table
+    compiled["accepting"] = accepting
+    compiled["init"] = state_index[dfa["init_state"]]
+    return compiled
+
+def step(cdfa, state, symbol):
+    sym = cdfa["symbol_index"].get(symbol)
+    if state == DEAD or sym is None:
+        return DEAD
+    return cdfa["table"][state * cdfa["n_symbols"] + sym]
+
+def run(cdfa, tokens):
+    # Returns the path of state indices; it ends with DEAD if the DFA gets stuck.
+    cdfa = compile_dfa(cdfa)
+    table = cdfa["table"]
+    symbol_index = cdfa["symbol_index"]
+    n_symbols = cdfa["n_symbols"]
+    state = cdfa["init"]
+    path = [state]
+    for symbol in tokens:
+        sym = symbol_index.get(symbol)
+        if sym is None:
+            path.append(DEAD)
+            break
+        state = table[state * n_symbols + sym]
+        path.append(state)
+        if state == DEAD:
+            break
+    return path
+
+def accepts(cdfa, tokens):
+    cdfa = compile_dfa(cdfa)
+    table = cdfa["table"]
+    symbol_index = cdfa["symbol_index"]
+    n_symbols = cdfa["n_symbols"]
+    state = cdfa["init"]
+    for symbol in tokens:
+        sym = symbol_index.get(symbol)
+        if sym is None:
+            return False
+        state = table[state * n_symbols + sym]
+        if state == DEAD:
+            return False
+    return cdfa["accepting"][state] == 1
+
+def minimize_dfa(dfa):
+    # Hopcroft's partition refinement on the reachable part of the DFA,
+    # completed with an explicit dead state.
+    cdfa = compile_dfa(dfa)
+    table, n_symbols = cdfa["table"], cdfa["n_symbols"]
+
+    reachable = [cdfa["init"]]
+    seen = {cdfa["init"]}
+    for state in reachable:
+        for sym in range(n_symbols):
+            target = table[state * n_symbols + sym]
+            if target != DEAD and target not in seen:
+                seen.add(target)
+                reachable.append(target)
+
+    local = {state: i for i, state in enumerate(reachable)}
+    dead = len(reachable)
+    n = dead + 1
+    delta = [[dead] * n_symbols for _ in range(n)]
+    for state in reachable:
+        row = delta[local[state]]
+        for sym in range(n_symbols):
+            target = table[state * n_symbols + sym]
+            if target != DEAD:
+                row[sym] = local[target]
+
+    inverse = [[[] for _ in range(n)] for _ in range(n_symbols)]
+    for q in range(n):
+        for sym in range(n_symbols):
+            inverse[sym][delta[q][sym]].append(q)
+
+    accepting = {local[state] for state in reachable if cdfa["accepting"][state]}
+    rejecting = set(range(n)) - accepting
+    blocks = [set(block) for block in (accepting, rejecting) if block]
+    block_of = [0] * n
+    for b, block in enumerate(blocks):
+        for q in block:
+            block_of[q] = b
+    worklist = {min(range(len(blocks)), key=lambda b: len(blocks[b]))}
+
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        for sym in range(n_symbols):
+            preds = {}
+            for q in splitter:
+                for p in inverse[sym][q]:
+                    preds.setdefault(block_of[p], set()).add(p)
+            for b, hit in preds.items():
+                block = blocks[b]
+                if len(hit) == len(block):
+                    continue
+                # Split in place: moving `hit` out costs O(|hit|), and only the
+                # smaller half is relabelled, which keeps the O(n k log n) bound.
+                block.difference_update(hit)
+                small, large = (hit, block) if len(hit) <= len(block) else (block, hit)
+                blocks[b] = large
+                blocks.append(small)
+                new_b = len(blocks) - 1
+                for q in small:
+                    block_of[q] = new_b
+                # Whether or not b was still waiting, the smaller half must be.
+                worklist.add(new_b)
+
+    # Renumber the blocks breadth-first from the initial state, dropping the dead block.
+    dead_block = block_of[dead]
+    names = {block_of[0]: "q0"}
+    order = [block_of[0]]
+    representative = {}
+    for q in range(n):
+        representative.setdefault(block_of[q], q)
+    transitions = []
+    for b in order:
+        if b == dead_block:
+            continue
+        for sym in range(n_symbols):
+            target = block_of[delta[representative[b]][sym]]
+            if target == dead_block:
+                continue
+            if target not in names:
+                names[target] = f"q{len(names)}"
+                order.append(target)
+            transitions.append((names[b], cdfa["symbols"][sym], names[target]))
+
+    return {
+        "symbols": list(cdfa["symbols"]),
+        "states": [names[b] for b in order],
+        "transitions": transitions,
+        "init_state": names[block_of[0]],
+        "fin_states": [names[b] for b in order if representative[b] in accepting],
+    }
+
+def walk(cdfa, state, tokens):
+    # Final state index after reading tokens from state; DEAD if the DFA gets stuck.
+    table, n_symbols = cdfa["table"], cdfa["n_symbols"]
+    symbol_index = cdfa["symbol_index"]
+    for symbol in tokens:
+        sym = symbol_index.get(symbol)
+        if sym is None:
+            return DEAD
+        state = table[state * n_symbols + sym]
+        if state == DEAD:
+            return DEAD
+    return state
+
+# A chunk is only worth summarizing if the paths from all states merge quickly:
+# following L paths costs about 2L sequential steps per token, so past the
+# warm-up prefix at most workers / PARALLEL_WORKERS_PER_PATH paths may be apart.
+PARALLEL_WARMUP = 1024
+PARALLEL_WORKERS_PER_PATH = 2
+PENDING_PER_WORKER = 2
+
+def parallel_max_live(n_states, workers):
+    # None when no chunk can exceed the cap, i.e. the DFA has few enough states.
+    max_live = max(workers // PARALLEL_WORKERS_PER_PATH, 1)
+    return None if n_states <= max_live else max_live
+
+def chunk_mapping(cdfa, tokens, origins=None, warmup=PARALLEL_WARMUP, max_live=None):
+    # Runs the chunk from every origin (all states by default) at once and
+    # returns where each one ends up; paths that merge are only followed once.
+    # Returns None if more than max_live paths are still apart after warmup tokens.
+    table, n_symbols = cdfa["table"], cdfa["n_symbols"]
+    symbol_index = cdfa["symbol_index"]
+    if origins is None:
+        origins = range(len(cdfa["states"]))
+    current = {state: [state] for state in origins}
+    for position, symbol in enumerate(tokens):
+        if position == warmup and max_live is not None and len(current) > max_live:
+            return None
+        sym = symbol_index.get(symbol)
+        if sym is None:
+            current = {}
+            break
+        merged = {}
+        for state, origins in current.items():
+            target = table[state * n_symbols + sym]
+            if target == DEAD:
+                continue
+            if target in merged:
+                merged[target].extend(origins)
+            else:
+                merged[target] = origins
+        current = merged
+        if not current:
+            break
+    mapping = array('l', [DEAD]) * len(cdfa["states"])
+    for state, origins in current.items():
+        for origin in origins:
+            mapping[origin] = state
+    return mapping
+
+_parallel = {}
+
+def _init_parallel(cdfa, max_live):
+    _parallel["cdfa"] = cdfa
+    _parallel["max_live"] = max_live
+
+def _chunk_mapping(tokens, origins=None):
+    return chunk_mapping(_parallel["cdfa"], tokens, origins, max_live=_parallel["max_live"])
+
+def _bounded_map(pool, func, chunks, window):
+    # Like pool.map, in order, but at most `window` chunks are in flight; the
+    # ones still queued are cancelled if the caller stops early.
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(func, *chunk))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def run_parallel(dfa, tokens, workers=None, chunk_size=1 << 20):
+    # Each chunk is summarized as a state -> state mapping on a process pool;
+    # composing the mappings in order gives the exact final state. The first
+    # chunk starts from the initial state only. A chunk whose paths fail to
+    # merge is walked here while the workers go on with the later chunks.
+    cdfa = compile_dfa(dfa)
+    workers = workers or os.cpu_count() or 1
+    if len(tokens) <= chunk_size or workers == 1:
+        return walk(cdfa, cdfa["init"], tokens)
+    max_live = parallel_max_live(len(cdfa["states"]), workers)
+    starts = range(0, len(tokens), chunk_size)
+    chunks = ((tokens[start:start + chunk_size], (cdfa["init"],) if start == 0 else None) for start in starts)
+    state = cdfa["init"]
+    with ProcessPoolExecutor(workers, initializer=_init_parallel, initargs=(cdfa, max_live)) as pool:
+        mappings = _bounded_map(pool, _chunk_mapping, chunks, PENDING_PER_WORKER * workers)
+        for start, mapping in zip(starts, mappings):
+            if mapping is None:
+                state = walk(cdfa, state, tokens[start:start + chunk_size])
+            else:
+                state = mapping[state]
+            if state == DEAD:
+                break
+        mappings.close()
+    return state
+
+def accepts_parallel(dfa, tokens, workers=None, chunk_size=1 << 20):
+    cdfa = compile_dfa(dfa)
+    state = run_parallel(cdfa, tokens, workers, chunk_size)
+    return state != DEAD and cdfa["accepting"][state] == 1
+
+PAD = -1
+
+def encode_batch(cdfa, strings, pad=PAD):
+    # Turns token lists into a 2-D array of symbol indices, padded on the right;
+    # unknown symbols get index n_symbols, which always leads to rejection.
+    if np is None:
+        raise ImportError("encode_batch requires numpy")
+    cdfa = compile_dfa(cdfa)
+    symbol_index = cdfa["symbol_index"]
+    unknown = cdfa["n_symbols"]
+    width = max((len(tokens) for tokens in strings), default=0)
+    encoded = np.full((len(strings), width), pad, dtype=np.int32)
+    for row, tokens in enumerate(strings):
+        encoded[row, :len(tokens)] = [symbol_index.get(symbol, unknown) for symbol in tokens]
+    return encoded
+
+def padded_tables(cdfa):
+    # Built on first use and kept in the compiled dict, so repeated batches share them.
+    if "padded_table" not in cdfa:
+        n_states, n_symbols = len(cdfa["states"]), cdfa["n_symbols"]
+        dead, padding = n_states, n_symbols + 1
+        # Extra row for the dead state, extra columns for unknown symbols and padding.
+        table = np.full((n_states + 1, n_symbols + 2), dead, dtype=np.int32)
+        dense = np.frombuffer(cdfa["table"], dtype=np.dtype(f"i{cdfa['table'].itemsize}"))
+        table[:n_states, :n_symbols] = np.where(dense == DEAD, dead, dense).reshape(n_states, n_symbols)
+        table[:, padding] = np.arange(n_states + 1)
+        accepting = np.zeros(n_states + 1, dtype=bool)
+        accepting[:n_states] = np.frombuffer(bytes(cdfa["accepting"]), dtype=np.uint8).astype(bool)
+        cdfa["padded_table"] = table
+        cdfa["padded_accepting"] = accepting
+    return cdfa["padded_table"], cdfa["padded_accepting"]
+
+def accepts_batch(cdfa, encoded, pad=PAD):
+    if np is None:
+        raise ImportError("accepts_batch requires numpy")
+    cdfa = compile_dfa(cdfa)
+    n_symbols = cdfa["n_symbols"]
+    unknown, padding = n_symbols, n_symbols + 1
+    table, accepting = padded_tables(cdfa)
+
+    encoded = np.asarray(encoded)
+    if encoded.ndim != 2:
+        raise ValueError("accepts_batch expects a 2-D array of symbol indices")
+    columns = np.where((encoded < 0) | (encoded >= n_symbols), unknown, encoded)
+    columns[encoded == pad] = padding
+
+    states = np.full(encoded.shape[0], cdfa["init"], dtype=np.int32)
+    for position in range(encoded.shape[1]):
+        states = table[states, columns[:, position]]
+    return accepting[states]
+
+def build_dfa(fdfa):
+    dfa = prep_dfa(fdfa)
+    if dfa is None or not check_dfa(dfa):
+        return None
+    return compile_dfa(dfa)
+
+def load_dfa(fdfa):
+    if abcbin.is_binary(fdfa):
+        return build_dfa(fdfa)
+    return cache.load_cached(fdfa, "dfa", build_dfa)
+
 def run_dfa(fdfa):
-    dfa= prep_dfa(fdfa)
-    if check_dfa(dfa):
+    cdfa = load_dfa(fdfa)
+    if cdfa is not None:
+        states = cdfa["states"]
         print("Select the mod you want to use:")
         print("1. Check a string")
         print("2. Check character by character")
@@ -102,47 +452,48 @@ def run_dfa(fdfa):
             mode = input("Enter 1 or 2: ")
         if mode == "1":
             string = input("Enter a string to check: ")
-            current_state = dfa["init_state"]
-            for symbol in string.split():
-                if symbol not in dfa["symbols"]:
+            tokens = string.split()
+            for symbol in tokens:
+                if symbol not in cdfa["symbol_index"]:
                     print(f"Error: Symbol '{symbol}' not recognized.")
                     return
-                next_st = next_state(dfa, current_state, symbol)
-                if next_st is None:
+            path = run(cdfa, tokens)
+            for i in range(1, len(path)):
+                current_state, symbol = states[path[i - 1]], tokens[i - 1]
+                if path[i] == DEAD:
                     print(f"No transition from state '{current_state}' with symbol '{symbol}'.")
                     return
-                print(f"Transitioning from state '{current_state}' to '{next_st}' with symbol '{symbol}'.")
-                current_state = next_st
-            if current_state in dfa["fin_states"]:
+                print(f"Transitioning from state '{current_state}' to '{states[path[i]]}' with symbol '{symbol}'.")
+            current_state = states[path[-1]]
+            if cdfa["accepting"][path[-1]]:
                 print(f"The string '{string}' is accepted by the DFA.")
             else:
                 print(f"The string '{string}' is not accepted by the DFA. Ended in state '{current_state}'.")
         elif mode == "2":
-            current_state = dfa["init_state"]
+            current = cdfa["init"]
             while True:
-                print(f"Current state: {current_state}")
+                print(f"Current state: {states[current]}")
                 print("Available transitions:")
-                for t in dfa["transitions"]:
-                    if t[0] == current_state:
+                for t in cdfa["transitions"]:
+                    if t[0] == states[current]:
                         print(f"  {t[0]} + {t[1]} > {t[2]}")
                 symbol = input("Enter a symbol to proceed (or type 'exit' to quit): ")
                 if symbol.lower() == "exit":
                     break
-                if symbol not in dfa["symbols"]:
+                if symbol not in cdfa["symbol_index"]:
                     print(f"Error: Symbol '{symbol}' not recognized.")
                     continue
-                next_st = next_state(dfa, current_state, symbol)
-                if next_st is None:
-                    print(f"No transition from state '{current_state}' with symbol '{symbol}'.")
+                nxt = step(cdfa, current, symbol)
+                if nxt == DEAD:
+                    print(f"No transition from state '{states[current]}' with symbol '{symbol}'.")
                     continue
-                print(f"Transitioning from state '{current_state}' to '{next_st}' with symbol '{symbol}'.")
-                current_state = next_st
-                if current_state in dfa["fin_states"]:
-                    print(f"Current state '{current_state}' is an accepting state.")
+                print(f"Transitioning from state '{states[current]}' to '{states[nxt]}' with symbol '{symbol}'.")
+                current = nxt
+                if cdfa["accepting"][current]:
+                    print(f"Current state '{states[current]}' is an accepting state.")
                 else:
-                    print(f"Current state '{current_state}' is not an accepting state.")
-            if current_state in dfa["fin_states"]:
-                print(f"Ended in accepting state '{current_state}'.")
+                    print(f"Current state '{states[current]}' is not an accepting state.")
+            if cdfa["accepting"][current]:
+                print(f"Ended in accepting state '{states[current]}'.")
             else:
-                print(f"Ended in non-accepting state '{current_state}'.")
-
+                print(f"Ended in non-accepting state '{states[current]}'.")
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+import nfa as nfa_module
+
+# A DFA built on demand from an NFA: every subset of NFA states the input
+# reaches becomes a cached DFA state whose transitions are filled in as they
+# are used. A step is the same as epsilon_closure(next_states(...)) in nfa.py,
+# done on the bitmasks from nfa.compile_nfa.
+
+
+def make_lazy_dfa(nfa, max_states=10000, thrash_ratio=0.5, window=1000, retry_after=10000):
+    return {
+        "nfa": nfa_module.compile_nfa(nfa),
+        "max_states": max_states,
+        "thrash_ratio": thrash_ratio,
+        "window_size": window,
+        "retry_after": retry_after,
+        "cache": OrderedDict(),
+        # Cached steps since the last thrash check, across all inputs.
+        "window": {"steps": 0, "misses": 0, "evictions": 0},
+        # Steps left to run without the cache after thrashing was detected.
+        "bypass": 0,
+        "stats": {"hits": 0, "misses": 0, "evictions": 0, "fallbacks": 0},
+    }
+
+
+def _check_window(ldfa):
+    # Once the cache is evicting and most steps miss anyway, plain set
+    # simulation is cheaper than maintaining the cache. After retry_after
+    # uncached steps the cache is tried again with a fresh window.
+    window = ldfa["window"]
+    if window["evictions"] and window["misses"] > ldfa["thrash_ratio"] * window["steps"]:
+        ldfa["bypass"] = ldfa["retry_after"]
+        ldfa["stats"]["fallbacks"] += 1
+    window["steps"] = window["misses"] = window["evictions"] = 0
+
+
+def _transition(ldfa, mask, symbol):
+    cache = ldfa["cache"]
+    stats = ldfa["stats"]
+    window = ldfa["window"]
+    window["steps"] += 1
+    if window["steps"] >= ldfa["window_size"]:
+        _check_window(ldfa)
+    row = cache.get(mask)
+    if row is not None:
+        cache.move_to_end(mask)
+        target = row.get(symbol)
+        if target is not None:
+            stats["hits"] += 1
+            return target
+    else:
+        row = {}
+        cache[mask] = row
+        if len(cache) > ldfa["max_states"]:
+            cache.popitem(last=False)
+            stats["evictions"] += 1
+            window["evictions"] += 1
+    stats["misses"] += 1
+    window["misses"] += 1
+    target = nfa_module.step_mask(ldfa["nfa"], mask, symbol)
+    row[symbol] = target
+    return target
+
+
+def accepts(ldfa, tokens):
+    cnfa = ldfa["nfa"]
+    if any(symbol not in cnfa["succ"] for symbol in tokens):
+        return False
+    mask = cnfa["init_mask"]
+    for symbol in tokens:
+        if ldfa["bypass"]:
+            ldfa["bypass"] -= 1
+            mask = nfa_module.step_mask(cnfa, mask, symbol)
+        else:
+            mask = _transition(ldfa, mask, symbol)
+        if not mask:
+            return False
+    return mask & cnfa["accept_mask"] != 0
+
+
+def cache_stats(ldfa):
+    stats = dict(ldfa["stats"])
+    lookups = stats["hits"] + stats["misses"]
+    stats["states"] = len(ldfa["cache"])
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,187 @@
+from array import array
+from collections.abc import MutableMapping
+
+# Compact in-memory form shared by every machine type. State and symbol names
+# are interned once; each transition is a row across a few int arrays, so it
+# costs a handful of bytes instead of a tuple of strings. Automaton behaves
+# like the dicts the prep_* functions used to return: machine["transitions"]
+# is a read-only sequence of the same tuples, materialized on access.
+
+FIELDS = {
+    "dfa": ("state", "symbol", "state"),
+    "nfa": ("state", "symbol", "state"),
+    "pda": ("state", "symbol", "symbol", "state", "push"),
+    "tm": ("state", "symbol", "state", "symbol", "symbol"),
+}
+
+
+class SymbolTable:
+    __slots__ = ("names", "index")
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+
+    def intern(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __getitem__(self, i):
+        return self.names[i]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+class TransitionView:
+    __slots__ = ("_machine",)
+
+    def __init__(self, machine):
+        self._machine = machine
+
+    def __len__(self):
+        return len(self._machine._lines)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._machine.transition(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("transition index out of range")
+        return self._machine.transition(i)
+
+    def __iter__(self):
+        return self._machine.rows()
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class Automaton(MutableMapping):
+    __slots__ = ("kind", "state_table", "symbol_table", "columns", "push_start", "push_data", "_lines",
+                 "_has_transitions", "_states", "_symbols", "_stack", "_init_state", "_fin_states", "_band",
+                 "extra")
+
+    KEYS = ("states", "init_state", "fin_states", "symbols", "stack", "band", "transitions", "transition_lines")
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.state_table = SymbolTable()
+        self.symbol_table = SymbolTable()
+        self.columns = [array('i') for field in FIELDS[kind] if field != "push"]
+        self.push_start = array('i', [0]) if kind == "pda" else None
+        self.push_data = array('i') if kind == "pda" else None
+        self._lines = array('i')
+        self._has_transitions = False
+        self._states = None
+        self._symbols = None
+        self._stack = None
+        self._init_state = None
+        self._fin_states = None
+        self._band = None
+        self.extra = {}
+
+    def add_transition(self, fields, lineno=0):
+        state, symbol = self.state_table.intern, self.symbol_table.intern
+        columns = self.columns
+        if self.kind == "pda":
+            source, top, read, target, push = fields
+            self.push_data.extend(symbol(s) for s in push)
+            self.push_start.append(len(self.push_data))
+            values = (state(source), symbol(top), symbol(read), state(target))
+        elif self.kind == "tm":
+            source, read, target, write, turn = fields
+            values = (state(source), symbol(read), state(target), symbol(write), symbol(turn))
+        else:
+            source, read, target = fields
+            values = (state(source), symbol(read), state(target))
+        for column, value in zip(columns, values):
+            column.append(value)
+        self._lines.append(lineno)
+        self._has_transitions = True
+
+    def rows(self, start=0, stop=None):
+        states, symbols = self.state_table.names, self.symbol_table.names
+        stop = len(self._lines) if stop is None else stop
+        columns = [column[start:stop] for column in self.columns]
+        if self.kind in ("dfa", "nfa"):
+            for source, symbol, target in zip(*columns):
+                yield states[source], symbols[symbol], states[target]
+        elif self.kind == "pda":
+            push_start, push_data = self.push_start, self.push_data
+            for i, (source, top, symbol, target) in enumerate(zip(*columns), start):
+                push = [symbols[s] for s in push_data[push_start[i]:push_start[i + 1]]]
+                yield states[source], symbols[top], symbols[symbol], states[target], push
+        else:
+            for source, symbol, target, write, turn in zip(*columns):
+                yield states[source], symbols[symbol], states[target], symbols[write], symbols[turn]
+
+    def transition(self, i):
+        return next(self.rows(i, i + 1))
+
+    def _known(self, key):
+        if key == "transitions":
+            return TransitionView(self) if self._has_transitions else None
+        if key == "transition_lines":
+            return self._lines if self._has_transitions else None
+        if key == "band":
+            return None if self._band is None else [self.symbol_table.names[s] for s in self._band]
+        return getattr(self, "_" + key)
+
+    def __getitem__(self, key):
+        value = self._known(key) if key in self.KEYS else self.extra.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == "transition_lines":
+            raise TypeError("'transition_lines' is filled in by add_transition")
+        if key == "transitions":
+            rows = list(value)
+            for column in self.columns + [self.push_data, self._lines]:
+                if column is not None:
+                    del column[:]
+            if self.push_start is not None:
+                del self.push_start[1:]
+            for row in rows:
+                self.add_transition(row)
+            self._has_transitions = True
+        elif key == "band":
+            self._band = array('i', (self.symbol_table.intern(s) for s in value))
+        elif key in self.KEYS:
+            if value is None:
+                pass
+            elif key in ("states", "fin_states"):
+                for state in value:
+                    self.state_table.intern(state)
+            elif key in ("symbols", "stack"):
+                for symbol in value:
+                    self.symbol_table.intern(symbol)
+            setattr(self, "_" + key, value)
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.KEYS:
+            raise TypeError(f"'{key}' cannot be removed")
+        del self.extra[key]
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if self._known(key) is not None:
+                yield key
+        yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Automaton({self.kind}, {dict(self)!r})"
@@ -1,4 +1,10 @@
+from collections import OrderedDict
+
+import abcbin
+import cache
+import model
 import prep
+import validate
 def prep_symbols(fsymbols):
     symbols = []
     for line in fsymbols:
@@ -19,7 +25,7 @@ def prep_states(fstates):
                 if init_state is None:
                     init_state = st
                 else:
-                    print(f"Error: Multiple initial states found: {init_state} and {st}.")
+                    print(f"Error: Multiple initial states found: {init_state} and {st}{prep.where(state)}.")
                     return None
             elif tip == 'accept':
                 fin_states.append(st)
@@ -32,51 +38,50 @@ def prep_states(fstates):
 
     return states, init_state, fin_states
 
-def prep_transitions(ftransitions):
-    transitions = []
+def prep_transitions(ftransitions, nfa=None):
+    if nfa is None:
+        nfa = model.Automaton("nfa")
+    nfa.setdefault("transitions", [])
     for transition in ftransitions:
         try:
             inp, rez = transition.split('>')
             in_state, symbol = inp.split('+')
-            transitions.append((in_state.strip(), symbol.strip(), rez.strip()))
+            nfa.add_transition((in_state.strip(), symbol.strip(), rez.strip()), getattr(transition, "lineno", 0))
         except ValueError:
-            print(f"Error: Invalid transition format: {transition}")
+            print(f"Error: Invalid transition format: {transition}{prep.where(transition)}")
             return None
-    return transitions
+    return nfa["transitions"]
 
 def prep_nfa(fnfa):
-    files = prep.prep_file(fnfa)
-    if not files:
+    if abcbin.is_binary(fnfa):
+        return abcbin.load(fnfa)
+    nfa = model.Automaton("nfa")
+    files = {}
+    for cap, lines in prep.iter_sections(fnfa):
+        if cap.upper() == "TRANSITIONS":
+            if prep_transitions(lines, nfa) is None:
+                return None
+        else:
+            files.setdefault(cap, []).extend(lines)
+    if not files and not nfa:
         print("Error: No data found in the file.")
         return None
-    nfa = {}
     for cap in files.keys():
         if cap.upper() == "SYMBOLS":
-            nfa["symbols"] = prep_symbols(files[cap])
-            if nfa["symbols"] is None:
+            symbols = prep_symbols(files[cap])
+            if symbols is None:
                 return None
+            nfa["symbols"] = symbols
         elif cap.upper() == "STATES":
-            nfa["states"], nfa["init_state"], nfa["fin_states"] = prep_states(files[cap])
-            if nfa["states"] is None:
-                return None
-        elif cap.upper() == "TRANSITIONS":
-            nfa["transitions"] = prep_transitions(files[cap])
-            if nfa["transitions"] is None:
+            result = prep_states(files[cap])
+            if result is None:
                 return None
+            nfa["states"], nfa["init_state"], nfa["fin_states"] = result
+    if "transitions" in nfa and "states" in nfa:
+        nfa["eps_closures"] = epsilon_closures(nfa)
     return nfa
 def check_nfa(nfa):
-    for t in nfa["transitions"]:
-        if t[0] not in nfa["states"]:
-            print(f"Error: Transition from non-existing state {t[0]}.")
-            return False
-        if t[1] not in nfa["symbols"]:
-            print(nfa["symbols"],t[1])
-            print(f"Error: Transition with non-existing symbol {t[1]}.")
-            return False
-        if t[2] not in nfa["states"]:
-            print(f"Error: Transition to non-existing state {t[2]}.")
-            return False
-    return True
+    return validate.check(nfa, "nfa")
 
 def next_states(nfa, current_states, symbol):
     next_states = []
@@ -87,23 +92,175 @@ def next_states(nfa, current_states, symbol):
     return next_states
 
 
+EPS_CACHE_SIZE = 4096
+
+def epsilon_closures(nfa):
+    # Tarjan's SCC algorithm over the epsilon graph. Components come out sinks
+    # first, so each closure is its own members plus the already finished
+    # closures of the components it points to.
+    edges = {}
+    for t in nfa["transitions"]:
+        if t[1] == 'epsilon':
+            edges.setdefault(t[0], []).append(t[2])
+
+    index = {}
+    low = {}
+    on_stack = set()
+    scc_stack = []
+    closures = {}
+    counter = 0
+    for root in list(nfa["states"]) + list(edges):
+        if root in index:
+            continue
+        work = [(root, iter(edges.get(root, ())))]
+        index[root] = low[root] = counter
+        counter += 1
+        scc_stack.append(root)
+        on_stack.add(root)
+        while work:
+            state, successors = work[-1]
+            advanced = False
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = low[succ] = counter
+                    counter += 1
+                    scc_stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(edges.get(succ, ()))))
+                    advanced = True
+                    break
+                if succ in on_stack:
+                    low[state] = min(low[state], index[succ])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[state])
+            if low[state] == index[state]:
+                members = []
+                while True:
+                    member = scc_stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    if member == state:
+                        break
+                closure = set(members)
+                for member in members:
+                    for succ in edges.get(member, ()):
+                        if succ in closures:
+                            closure |= closures[succ]
+                closure = frozenset(closure)
+                for member in members:
+                    closures[member] = closure
+    return closures
+
 def epsilon_closure(nfa, states):
-    closure = set(states)
-    stack = list(states)
+    closures = nfa.get("eps_closures")
+    if closures is None:
+        closure = set(states)
+        stack = list(states)
 
-    while stack:
-        state = stack.pop()
-        for transition in nfa["transitions"]:
-            if transition[0] == state and transition[1] == 'epsilon':
-                if transition[2] not in closure:
-                    closure.add(transition[2])
-                    stack.append(transition[2])
+        while stack:
+            state = stack.pop()
+            for transition in nfa["transitions"]:
+                if transition[0] == state and transition[1] == 'epsilon':
+                    if transition[2] not in closure:
+                        closure.add(transition[2])
+                        stack.append(transition[2])
 
-    return closure
+        return closure
 
-def run_nfa(fnfa):
+    key = frozenset(states)
+    cache = nfa.setdefault("eps_cache", OrderedDict())
+    closure = cache.get(key)
+    if closure is None:
+        closure = set()
+        for state in key:
+            closure |= closures.get(state, (state,))
+        closure = frozenset(closure)
+        cache[key] = closure
+        if len(cache) > EPS_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return set(closure)
+
+def compile_nfa(nfa):
+    # States become bit positions; for every (symbol, state) we keep the mask of
+    # successors and the same mask already closed under epsilon moves.
+    if "succ" in nfa:
+        return nfa
+    state_index = {state: i for i, state in enumerate(nfa["states"])}
+    move = {symbol: [0] * len(nfa["states"]) for symbol in nfa["symbols"]}
+    for t in nfa["transitions"]:
+        move[t[1]][state_index[t[0]]] |= 1 << state_index[t[2]]
+
+    compiled = dict(nfa)
+    compiled["state_index"] = state_index
+    closures = nfa.get("eps_closures") or epsilon_closures(nfa)
+    compiled["closure"] = [state_mask(compiled, closures[state]) for state in nfa["states"]]
+    compiled["move"] = move
+    compiled["succ"] = {symbol: [closure_mask(compiled, mask) for mask in masks] for symbol, masks in move.items()}
+    compiled["init_mask"] = compiled["closure"][state_index[nfa["init_state"]]]
+    compiled["accept_mask"] = state_mask(compiled, nfa["fin_states"])
+    return compiled
+
+def state_mask(cnfa, states):
+    mask = 0
+    for state in states:
+        mask |= 1 << cnfa["state_index"][state]
+    return mask
+
+def mask_states(cnfa, mask):
+    return [state for i, state in enumerate(cnfa["states"]) if mask >> i & 1]
+
+def _union(masks, mask):
+    out = 0
+    while mask:
+        low = mask & -mask
+        out |= masks[low.bit_length() - 1]
+        mask ^= low
+    return out
+
+def closure_mask(cnfa, mask):
+    return _union(cnfa["closure"], mask)
+
+def move_mask(cnfa, mask, symbol):
+    masks = cnfa["move"].get(symbol)
+    return _union(masks, mask) if masks else 0
+
+def step_mask(cnfa, mask, symbol):
+    masks = cnfa["succ"].get(symbol)
+    return _union(masks, mask) if masks else 0
+
+def accepts(nfa, tokens):
+    cnfa = compile_nfa(nfa)
+    succ = cnfa["succ"]
+    mask = cnfa["init_mask"]
+    for symbol in tokens:
+        masks = succ.get(symbol)
+        if masks is None:
+            return False
+        mask = _union(masks, mask)
+        if not mask:
+            return False
+    return mask & cnfa["accept_mask"] != 0
+
+def build_nfa(fnfa):
     nfa = prep_nfa(fnfa)
-    if check_nfa(nfa):
+    if nfa is None or not check_nfa(nfa):
+        return None
+    return compile_nfa(nfa)
+
+def load_nfa(fnfa):
+    if abcbin.is_binary(fnfa):
+        return build_nfa(fnfa)
+    return cache.load_cached(fnfa, "nfa", build_nfa)
+
+def run_nfa(fnfa):
+    cnfa = load_nfa(fnfa)
+    if cnfa is not None:
         print("Select the mod you want to use:")
         print("1. Check a string")
         print("2. Check character by character")
@@ -112,54 +269,52 @@ def run_nfa(fnfa):
             print("Invalid choice. Please enter 1 or 2.")
             mode = input("Enter 1 or 2: ")
 
-        current_states = list(epsilon_closure(nfa, [nfa["init_state"]]))
+        current = cnfa["init_mask"]
 
         if mode == "1":
             string = input("Enter a string: ")
             for symbol in string.split():
-                if symbol not in nfa["symbols"]:
+                if symbol not in cnfa["symbols"]:
                     print(f"Error: Symbol '{symbol}' not recognized.")
                     return
 
             for symbol in string.split():
-                next_st = next_states(nfa, current_states, symbol)
-                if not next_st:
-                    print(f"No transition from states {current_states} with symbol '{symbol}'.")
+                moved = move_mask(cnfa, current, symbol)
+                if not moved:
+                    print(f"No transition from states {mask_states(cnfa, current)} with symbol '{symbol}'.")
                     return
-                print(f"Transitioning from states {current_states} to {next_st} with symbol '{symbol}'.")
-                current_states = list(epsilon_closure(nfa, next_st))
+                print(f"Transitioning from states {mask_states(cnfa, current)} to {mask_states(cnfa, moved)} with symbol '{symbol}'.")
+                current = closure_mask(cnfa, moved)
 
-            if any(state in nfa["fin_states"] for state in current_states):
-                print(f"The string is accepted by the NFA, ending in states: {current_states}.")
+            if current & cnfa["accept_mask"]:
+                print(f"The string is accepted by the NFA, ending in states: {mask_states(cnfa, current)}.")
             else:
-                print(f"The string is not accepted by the NFA, ending in states: {current_states}.")
+                print(f"The string is not accepted by the NFA, ending in states: {mask_states(cnfa, current)}.")
         else :
             while True:
+                current_states = mask_states(cnfa, current)
                 print(f"Current states: {current_states}")
                 print("Available transitions:")
-                for t in nfa["transitions"]:
+                for t in cnfa["transitions"]:
                     if t[0] in current_states:
                         print(f"  {t[0]} + {t[1]} > {t[2]}")
                 symbol = input("Enter a symbol to proceed (or type 'exit' to quit): ")
                 if symbol.lower() == "exit":
                     break
-                if symbol not in nfa["symbols"]:
+                if symbol not in cnfa["symbols"]:
                     print(f"Error: Symbol '{symbol}' not recognized.")
                     continue
-                next_st = next_states(nfa, current_states, symbol)
-                if not next_st:
+                moved = move_mask(cnfa, current, symbol)
+                if not moved:
                     print(f"No transition from states {current_states} with symbol '{symbol}'.")
                     continue
-                print(f"Transitioning from states {current_states} to {next_st} with symbol '{symbol}'.")
-                current_states = list(epsilon_closure(nfa, next_st))
-                if any(state in nfa["fin_states"] for state in current_states):
-                    print(f"Current states {current_states} include accepting states.")
+                print(f"Transitioning from states {current_states} to {mask_states(cnfa, moved)} with symbol '{symbol}'.")
+                current = closure_mask(cnfa, moved)
+                if current & cnfa["accept_mask"]:
+                    print(f"Current states {mask_states(cnfa, current)} include accepting states.")
                 else:
-                    print(f"Current states {current_states} do not include accepting states.")
-            if any(state in nfa["fin_states"] for state in current_states):
-                print(f"Ending in accepting states: {current_states}.")
+                    print(f"Current states {mask_states(cnfa, current)} do not include accepting states.")
+            if current & cnfa["accept_mask"]:
+                print(f"Ending in accepting states: {mask_states(cnfa, current)}.")
             else:
-                print(f"Ending in non-accepting states: {current_states}.")
-
-
-
+                print(f"Ending in non-accepting states: {mask_states(cnfa, current)}.")
@@ -1,7 +1,94 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import abcbin
+import cache
 import nfa
+from dfa import minimize_dfa
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Cât de des (în stări DFA procesate) verificăm timpul, memoria și salvăm checkpoint-ul
+BUDGET_CHECK_EVERY = 256
+
+# Câte stări din front trimitem odată unui worker
+FRONTIER_CHUNK = 512
+
+
+def peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def subset_states(nfa_states, mask):
+    return sorted(state for i, state in enumerate(nfa_states) if mask >> i & 1)
+
+
+def save_checkpoint(path, fnfa, nfa_states, dfa_symbols, dfa_states, state_subsets, dfa_transitions,
+                    dfa_fin_states, worklist):
+    data = {
+        "nfa": os.path.abspath(fnfa),
+        "digest": cache.file_digest(fnfa),
+        "symbols": dfa_symbols,
+        "states": dfa_states,
+        "subsets": [subset_states(nfa_states, subset) for subset in state_subsets],
+        "transitions": dfa_transitions,
+        "fin_states": dfa_fin_states,
+        "worklist": worklist,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, fnfa, dfa_symbols):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if data["nfa"] != os.path.abspath(fnfa) or data["symbols"] != dfa_symbols:
+        print(f"Error: Checkpoint '{path}' was made for a different NFA.")
+        return None
+    if data.get("digest") != cache.file_digest(fnfa):
+        print(f"Error: '{fnfa}' changed since checkpoint '{path}' was saved; start over without --resume.")
+        return None
+    return data
+
+
+def expand(successors, dfa_symbols, subset):
+    # Pentru o stare DFA (mască de stări NFA) calculăm închiderea succesorilor pe fiecare simbol
+    next_closures = {}
+    while subset:
+        low = subset & -subset
+        subset ^= low
+        for symbol, mask in successors[low.bit_length() - 1].items():
+            next_closures[symbol] = next_closures.get(symbol, 0) | mask
+    return [(symbol, next_closures[symbol]) for symbol in dfa_symbols if symbol in next_closures]
+
+
+_worker = {}
+
+
+def _init_worker(successors, dfa_symbols):
+    _worker["successors"] = successors
+    _worker["symbols"] = dfa_symbols
 
 
-def nfa2dfa(fnfa):
+def _expand_batch(subsets):
+    return [expand(_worker["successors"], _worker["symbols"], subset) for subset in subsets]
+
+
+def nfa2dfa(fnfa, max_states=None, max_memory=None, max_time=None,
+            checkpoint=None, checkpoint_every=10000, resume=False, workers=1):
     # Pregătim și validăm NFA-ul
     nfa_data = nfa.prep_nfa(fnfa)
     if nfa_data is None or not nfa.check_nfa(nfa_data):
@@ -14,89 +101,121 @@ def nfa2dfa(fnfa):
     # Eliminăm epsilon din simboluri pentru DFA
     dfa_symbols = [s for s in nfa_data["symbols"] if s not in ["e", "ε", "Îµ", "epsilon"]]
 
+    # Stările NFA devin biți; indexăm succesorii (deja închiși la epsilon)
+    # pentru fiecare pereche (stare, simbol)
+    cnfa = nfa.compile_nfa(nfa_data)
+    nfa_states = nfa_data["states"]
+    successors = [{} for _ in nfa_states]
+    for symbol in dfa_symbols:
+        for i, mask in enumerate(cnfa["succ"][symbol]):
+            if mask:
+                successors[i][symbol] = mask
+
+    fin_states = cnfa["accept_mask"]
+
     # Calculăm epsilon closure pentru starea inițială
-    start_closure = sorted(list(nfa.epsilon_closure(nfa_data, [nfa_data["init_state"]])))
+    start_closure = cnfa["init_mask"]
 
     # Componentele DFA-ului
-    dfa_states = []
+    dfa_states = ["q0"]
     dfa_transitions = []
-    dfa_fin_states = []
-    dfa_init_state = None
-    state_map = {}
-    state_counter = 0
-
-    # Inițializăm states2process
-    states2process = [start_closure]
-    processed = []
-
-    # Procesăm fiecare stare DFA
-    while states2process:
-        curr_nfa_states = states2process.pop(0)
-
-        if curr_nfa_states in processed:
-            continue
-        processed.append(curr_nfa_states)
-
-        # Găsim sau creăm numele stării DFA
-        curr_dfa_state = None
-        for dfa_state, nfa_state_set in state_map.items():
-            if nfa_state_set == curr_nfa_states:
-                curr_dfa_state = dfa_state
-                break
-
-        if curr_dfa_state is None:
-            curr_dfa_state = f"q{state_counter}"
-            state_map[curr_dfa_state] = curr_nfa_states
-            dfa_states.append(curr_dfa_state)
-            state_counter += 1
-
-            # Setăm starea inițială DFA
-            if curr_nfa_states == start_closure:
-                dfa_init_state = curr_dfa_state
-
-            # Verificăm dacă e stare finală
-            if any(state in nfa_data["fin_states"] for state in curr_nfa_states):
-                dfa_fin_states.append(curr_dfa_state)
-
-        # Calculăm tranzițiile pentru fiecare simbol
-        for symbol in dfa_symbols:
-            next_nfa_states = []
-
-            # Găsim toate stările NFA accesibile cu acest simbol
-            for nfa_state in curr_nfa_states:
-                next_nfa_states.extend(nfa.next_states(nfa_data, [nfa_state], symbol))
-
-            # Eliminăm duplicatele
-            next_nfa_states = list(set(next_nfa_states))
-
-            if next_nfa_states:
-                # Calculăm epsilon closure
-                next_closure = sorted(list(nfa.epsilon_closure(nfa_data, next_nfa_states)))
-
-                # Verificăm dacă această combinație există deja
-                existing_dfa_state = None
-                for dfa_state, nfa_state_set in state_map.items():
-                    if nfa_state_set == next_closure:
-                        existing_dfa_state = dfa_state
-                        break
-
-                if existing_dfa_state:
-                    target_state = existing_dfa_state
-                else:
+    dfa_fin_states = ["q0"] if start_closure & fin_states else []
+    dfa_init_state = "q0"
+    state_ids = {start_closure: "q0"}
+    state_subsets = [start_closure]
+
+    # Coada de stări DFA neprocesate
+    states2process = deque([start_closure])
+
+    # Reluăm dintr-un checkpoint, dacă există
+    if resume and checkpoint and os.path.exists(checkpoint):
+        data = load_checkpoint(checkpoint, fnfa, dfa_symbols)
+        if data is None:
+            return None
+        dfa_states = data["states"]
+        dfa_transitions = [tuple(t) for t in data["transitions"]]
+        dfa_fin_states = data["fin_states"]
+        state_subsets = [nfa.state_mask(cnfa, subset) for subset in data["subsets"]]
+        state_ids = dict(zip(state_subsets, dfa_states))
+        states2process = deque(state_subsets[int(name[1:])] for name in data["worklist"])
+        print(f"Resuming from '{checkpoint}': {len(dfa_states)} DFA states, {len(states2process)} left to process.")
+
+    if max_memory is not None and resource is None:
+        print("Warning: Memory usage cannot be measured on this platform; ignoring the memory limit.")
+    started = time.monotonic()
+
+    def stop(reason):
+        done = len(dfa_states) - len(states2process)
+        print(f"Error: {reason}; stopped after processing {done} of {len(dfa_states)} discovered DFA states "
+              f"({len(dfa_transitions)} transitions).")
+        if checkpoint:
+            save_checkpoint(checkpoint, fnfa, nfa_states, dfa_symbols, dfa_states, state_subsets, dfa_transitions,
+                            dfa_fin_states, [state_ids[subset] for subset in states2process])
+            print(f"Progress saved to '{checkpoint}'; resume from it to continue.")
+        return None
+
+    # Cu mai mulți workeri, extindem tot frontul BFS deodată pe un pool de procese;
+    # rezultatele sunt integrate în ordinea cozii, deci numerotarea rămâne aceeași
+    pool = None
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_worker, initargs=(successors, dfa_symbols))
+
+    try:
+        # Procesăm fiecare stare DFA
+        processed = 0
+        while states2process:
+            if pool is not None:
+                frontier = list(states2process)
+                size = max(1, min(FRONTIER_CHUNK, len(frontier) // (workers * 4)))
+                expanded = []
+                for batch in pool.imap(_expand_batch, [frontier[i:i + size] for i in range(0, len(frontier), size)]):
+                    expanded.extend(batch)
+            else:
+                expanded = [expand(successors, dfa_symbols, states2process[0])]
+
+            for moves in expanded:
+                processed += 1
+                if processed % BUDGET_CHECK_EVERY == 0:
+                    if max_time is not None and time.monotonic() - started > max_time:
+                        return stop(f"Time limit of {max_time}s exceeded")
+                    if max_memory is not None and (peak_memory() or 0) > max_memory:
+                        return stop(f"Memory limit of {max_memory} bytes exceeded")
+                if checkpoint and processed % checkpoint_every == 0:
+                    save_checkpoint(checkpoint, fnfa, nfa_states, dfa_symbols, dfa_states, state_subsets,
+                                    dfa_transitions, dfa_fin_states, [state_ids[subset] for subset in states2process])
+
+                curr_dfa_state = state_ids[states2process[0]]
+
+                # Stările noi rămân în așteptare până știm că încap în limită
+                new_states = {}
+                new_transitions = []
+                for symbol, next_closure in moves:
+                    target_state = state_ids.get(next_closure) or new_states.get(next_closure)
+                    if target_state is None:
+                        target_state = f"q{len(dfa_states) + len(new_states)}"
+                        new_states[next_closure] = target_state
+                    new_transitions.append((curr_dfa_state, symbol, target_state))
+
+                if max_states is not None and len(dfa_states) + len(new_states) > max_states:
+                    return stop(f"DFA state limit of {max_states} exceeded")
+
+                states2process.popleft()
+                for next_closure, target_state in new_states.items():
                     # Creăm stare nouă DFA
-                    target_state = f"q{state_counter}"
-                    state_map[target_state] = next_closure
+                    state_ids[next_closure] = target_state
+                    state_subsets.append(next_closure)
                     dfa_states.append(target_state)
                     states2process.append(next_closure)
-                    state_counter += 1
 
                     # Verificăm dacă e stare finală
-                    if any(state in nfa_data["fin_states"] for state in next_closure):
+                    if next_closure & fin_states:
                         dfa_fin_states.append(target_state)
 
-                # Adăugăm tranziția
-                dfa_transitions.append((curr_dfa_state, symbol, target_state))
-
+                # Adăugăm tranzițiile
+                dfa_transitions.extend(new_transitions)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
     # Returnăm DFA-ul
     return {
@@ -105,11 +224,18 @@ def nfa2dfa(fnfa):
         'transitions': dfa_transitions,
         'init_state': dfa_init_state,
         'fin_states': dfa_fin_states,
-        'state_map': state_map
+        'state_map': {name: subset_states(nfa_states, subset) for subset, name in zip(state_subsets, dfa_states)}
     }
 
 
-def save_dfa(dfa, filename):
+def save_dfa(dfa, filename, minimize=False):
+    if minimize:
+        before = len(dfa["states"])
+        dfa = minimize_dfa(dfa)
+        print(f"Minimized DFA: {before} states -> {len(dfa['states'])} states")
+    if filename.endswith(abcbin.EXTENSION):
+        abcbin.save(dfa, filename, "dfa")
+        return
     with open(filename, 'w' ) as f:
         f.write("[States]\n")
         for state in dfa["states"]:
@@ -130,4 +256,31 @@ def save_dfa(dfa, filename):
             f.write(f"{trans[0]} + {trans[1]} > {trans[2]}\n")
         f.write("DONE\n")
 
-save_dfa(nfa2dfa("nfa.abc"), "n2d.t1")
\ No newline at end of file
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an NFA to a DFA with the subset construction.")
+    parser.add_argument("nfa", nargs="?", default="nfa.abc")
+    parser.add_argument("output", nargs="?", default="n2d.t1")
+    parser.add_argument("--minimize", action="store_true", help="minimize the DFA before saving it")
+    parser.add_argument("--max-states", type=int, help="abort once the DFA would have more states")
+    parser.add_argument("--max-memory", type=int, help="abort once peak memory exceeds this many bytes")
+    parser.add_argument("--max-time", type=float, help="abort after this many seconds")
+    parser.add_argument("--checkpoint", help="file where progress is saved periodically and on abort")
+    parser.add_argument("--checkpoint-every", type=int, default=10000, help="DFA states processed between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint file if it exists")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="expand each BFS frontier on this many processes")
+    args = parser.parse_args(argv)
+
+    dfa = nfa2dfa(args.nfa, max_states=args.max_states, max_memory=args.max_memory, max_time=args.max_time,
+                  checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every, resume=args.resume,
+                  workers=args.workers)
+    if dfa is None:
+        return 1
+    save_dfa(dfa, args.output, minimize=args.minimize)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,9 @@
+import weakref
+
+import cache
+import model
 import prep
+import validate
 
 
 def prep_states(fstates):
@@ -13,7 +18,7 @@ def prep_states(fstates):
                 if init_state is None:
                     init_state = st.strip()
                 else:
-                    print(f"Error: Multiple initial states found: {init_state} and {st}.")
+                    print(f"Error: Multiple initial states found: {init_state} and {st}{prep.where(state)}.")
                     return None
             elif tip == 'accept':
                 fin_states.append(st.strip())
@@ -47,8 +52,10 @@ def prep_stack(fstack):
     return stack if stack else None
 
 
-def prep_transitions(ftransitions):
-    transitions = []
+def prep_transitions(ftransitions, pda=None):
+    if pda is None:
+        pda = model.Automaton("pda")
+    pda.setdefault("transitions", [])
     for transition in ftransitions:
         try:
             inp, rez = transition.split('>')
@@ -56,37 +63,42 @@ def prep_transitions(ftransitions):
             in_state, stack_top = cond.split('&')
             next_state, stack_push = rez.split(',', 1)
             stack_push = [s.strip() for s in stack_push.split()]
-            transitions.append((in_state.strip(), stack_top.strip(), symbol.strip(), next_state.strip(), stack_push))
+            pda.add_transition((in_state.strip(), stack_top.strip(), symbol.strip(), next_state.strip(), stack_push),
+                               getattr(transition, "lineno", 0))
         except ValueError:
-            print(f"Error: Transition {transition} is invalid.")
+            print(f"Error: Transition {transition} is invalid{prep.where(transition)}.")
             return None
-    return transitions
+    return pda["transitions"]
 
 
 def prep_pda(fpda):
-    files = prep.prep_file(fpda)
-    if not files:
+    pda = model.Automaton("pda")
+    files = {}
+    for cap, lines in prep.iter_sections(fpda):
+        if cap.upper() == "TRANSITIONS":
+            if prep_transitions(lines, pda) is None:
+                return None
+        else:
+            files.setdefault(cap, []).extend(lines)
+    if not files and not pda:
         print("Error: No data found in the file.")
         return None
-    pda = {}
     for cap in files.keys():
         if cap.upper() == "SYMBOLS":
-            pda["symbols"] = prep_symbols(files[cap])
-            if pda["symbols"] is None:
+            symbols = prep_symbols(files[cap])
+            if symbols is None:
                 return None
+            pda["symbols"] = symbols
         elif cap.upper() == "STATES":
             result = prep_states(files[cap])
             if result is None:
                 return None
             pda["states"], pda["init_state"], pda["fin_states"] = result
         elif cap.upper() == "STACK":
-            pda["stack"] = prep_stack(files[cap])
-            if pda["stack"] is None:
-                return None
-        elif cap.upper() == "TRANSITIONS":
-            pda["transitions"] = prep_transitions(files[cap])
-            if pda["transitions"] is None:
+            stack = prep_stack(files[cap])
+            if stack is None:
                 return None
+            pda["stack"] = stack
         else:
             print(f"Warning: Unrecognized section '{cap}' in PDA file.")
 
@@ -94,132 +106,371 @@ def prep_pda(fpda):
 
 
 def check_pda(pda):
-    for t in pda["transitions"]:
-        if t[0] not in pda["states"]:
-            print(f"Error: Transition from non-existing state {t[0]}.")
-            return False
-        if t[1] not in pda["stack"] and t[1] != "epsilon":
-            print(pda["stack"], t[1])
-            print(f"Error: Transition with non-existing stack top {t[1]}.")
-            return False
-        if t[2] not in pda["symbols"] and t[2] != "epsilon":
-            print(f"Error: Transition with non-existing symbol {t[2]}.")
-            return False
-        if t[3] not in pda["states"]:
-            print(f"Error: Transition to non-existing state {t[3]}.")
-            return False
-        for s in t[4]:
-            print(t[4])
-            if s not in pda["stack"] and s != "epsilon":
-                print(f"Error: Transition with non-existing stack push {s}.")
-                return False
-    return True
+    return validate.check(pda, "pda")
 
 
-def epsilon_closure(pda, states_with_stacks):
-    closure = set()
-    stack = list(states_with_stacks)
+MAX_CONFIGS = 100000
+DEPTH_SLACK = 32
 
-    while stack:
-        current_state, current_stack = stack.pop()
-        state_stack_key = (current_state, tuple(current_stack))
 
-        if state_stack_key in closure:
-            continue
-        closure.add(state_stack_key)
+class Stack:
+    # Immutable stack cell: `top` sitting on the stack `below` (None is the
+    # empty stack). Cells are hash-consed by push, so equal stacks are the same
+    # object, tails are shared and comparing two stacks is an identity check.
+    __slots__ = ("top", "below", "depth", "__weakref__")
 
-        stack_top = current_stack[-1] if current_stack else "epsilon"
+    def __init__(self, top, below):
+        self.top = top
+        self.below = below
+        self.depth = below.depth + 1 if below is not None else 1
 
-        for tr in pda["transitions"]:
-            ti, expected_stack_top, sym, to, stack_push = tr
-            if ti == current_state and sym == "epsilon" and expected_stack_top == stack_top:
-                new_stack = current_stack.copy()
 
-                if expected_stack_top != "epsilon" and new_stack:
-                    new_stack.pop()
+_stacks = weakref.WeakValueDictionary()
 
-                if stack_push != ["epsilon"]:
-                    for s in reversed(stack_push):
-                        new_stack.append(s)
 
-                new_state_stack = (to, tuple(new_stack))
-                if new_state_stack not in closure:
-                    stack.append((to, new_stack))
+def push(below, symbol):
+    key = (symbol, below)
+    node = _stacks.get(key)
+    if node is None:
+        node = _stacks[key] = Stack(symbol, below)
+    return node
 
-    return [(state, list(stack_tuple)) for state, stack_tuple in closure]
 
+def stack_top(stack):
+    return stack.top if stack is not None else "epsilon"
 
-def next_states(pda, current_states_stacks, symbol):
-    next_states = []
 
-    for current_state, current_stack in current_states_stacks:
-        stack_top = current_stack[-1] if current_stack else "epsilon"
+def stack_list(stack):
+    items = []
+    while stack is not None:
+        items.append(stack.top)
+        stack = stack.below
+    items.reverse()
+    return items
 
-        for tr in pda["transitions"]:
-            ti, expected_stack_top, sym, to, stack_push = tr
-            if ti == current_state and expected_stack_top == stack_top and sym == symbol:
-                new_stack = current_stack.copy()
 
-                if expected_stack_top != "epsilon" and new_stack:
-                    new_stack.pop()
+def apply_transition(stack, expected_stack_top, stack_push):
+    if expected_stack_top != "epsilon" and stack is not None:
+        stack = stack.below
+    if stack_push != ["epsilon"]:
+        for s in reversed(stack_push):
+            stack = push(stack, s)
+    return stack
 
-                if stack_push != ["epsilon"]:
-                    for s in reversed(stack_push):
-                        new_stack.append(s)
 
-                next_states.append((to, new_stack))
+def show(configurations):
+    return [(state, stack_list(stack)) for state, stack in configurations]
 
-    return next_states
 
+def compile_pda(pda):
+    # Transitions indexed by what must match before they fire: "moves" maps
+    # (state, stack_top, symbol) and "eps_moves" maps (state, stack_top) for
+    # epsilon input. A stack_top of "epsilon" is the empty-stack bucket.
+    if "moves" in pda:
+        return pda
+    moves = {}
+    eps_moves = {}
+    for ti, expected_stack_top, sym, to, stack_push in pda["transitions"]:
+        if sym == "epsilon":
+            bucket = eps_moves.setdefault((ti, expected_stack_top), [])
+        else:
+            bucket = moves.setdefault((ti, expected_stack_top, sym), [])
+        bucket.append((to, expected_stack_top, stack_push))
+    compiled = dict(pda)
+    compiled["moves"] = moves
+    compiled["eps_moves"] = eps_moves
+    compiled["max_push"] = max((len(t[4]) for t in pda["transitions"] if t[4] != ["epsilon"]), default=0)
+    compiled["deterministic"] = not conflicts(compiled)
+    # Epsilon moves that pop without pushing; without them only input moves
+    # can uncover the stack, one symbol each.
+    compiled["eps_pops"] = any(sym == "epsilon" and top != "epsilon" and push == ["epsilon"]
+                               for _, top, sym, _, push in pda["transitions"])
+    return compiled
+
+
+def conflicts(pda):
+    # Pairs of different transitions that can fire on the same configuration:
+    # two input moves on the same (state, stack_top, symbol), two epsilon
+    # moves on the same (state, stack_top), or an epsilon move next to an
+    # input move. No conflicts means the PDA is deterministic.
+    found = []
+    with_input = {}
+    for (state, top, symbol), bucket in pda["moves"].items():
+        with_input.setdefault((state, top), []).append(bucket[0])
+        distinct = {(to, tuple(push)) for to, _, push in bucket}
+        if len(distinct) > 1:
+            found.append(f"{state} & {top} + {symbol}")
+    for (state, top), bucket in pda["eps_moves"].items():
+        distinct = {(to, tuple(push)) for to, _, push in bucket}
+        if len(distinct) > 1 or (state, top) in with_input:
+            found.append(f"{state} & {top} + epsilon")
+    return found
+
+
+def depth(stack):
+    return stack.depth if stack is not None else 0
+
+
+def pumps(found, config, parent, low):
+    # Returns the ancestor in the same state with the same top symbol if the
+    # moves since then never reached below that symbol: they only depended on
+    # the state and the top, so they can repeat forever, growing the stack.
+    # `low` is the lowest stack depth reached by the move into `config`.
+    state, stack = config
+    lowest = low
+    while parent is not None and lowest > 0:
+        ancestor_state, ancestor_stack = parent
+        d = depth(ancestor_stack)
+        if (ancestor_state == state and ancestor_stack is not None and depth(stack) > d
+                and lowest >= d - 1 and stack.top == ancestor_stack.top):
+            below = stack
+            for _ in range(depth(stack) - d + 1):
+                below = below.below
+            if below is ancestor_stack.below:
+                return parent
+        parent, _, parent_low = found[parent]
+        lowest = min(lowest, parent_low)
+    return None
+
+
+def same_top(stack, other, n):
+    # True when both stacks hold more than n symbols and agree on the top n + 1.
+    if depth(stack) <= n or depth(other) <= n:
+        return False
+    for _ in range(n + 1):
+        if stack is other:
+            return True
+        if stack.top != other.top:
+            return False
+        stack, other = stack.below, other.below
+    return True
 
-def run_pda(fpda):
-    pda = prep_pda(fpda)
-    print(f"Stack alphabet: {pda['stack']}")
-    if not pda or not check_pda(pda):
-        return None
 
-    print("PDA Transitions:")
-    for t in pda["transitions"]:
-        print(f"  {t[0]} & {t[1]} + {t[2]} > {t[3]}, {' '.join(t[4])}")
+def epsilon_closure(pda, states_with_stacks, max_growth=None, max_configs=MAX_CONFIGS, budget=None,
+                    pop_bound=None):
+    # Epsilon moves may push at most max_growth symbols above the configuration
+    # they started from and at most max_configs configurations are kept. When
+    # one of these limits cuts the search short the reason is stored in
+    # budget["exceeded"]. If the rest of the run can pop at most pop_bound
+    # symbols, a pumping cycle stops once it reaches a configuration that
+    # agrees with its ancestor on every symbol that can still be uncovered;
+    # that cut is exact and does not touch the budget.
+    eps_moves = compile_pda(pda)["eps_moves"]
+    budget = {} if budget is None else budget
+    found = {}
+    pending = []
+    for config in states_with_stacks:
+        if config not in found:
+            found[config] = (None, depth(config[1]), depth(config[1]))
+            pending.append(config)
+
+    while pending:
+        config = pending.pop()
+        current_state, current_stack = config
+        base = found[config][1]
+
+        for to, expected_stack_top, stack_push in eps_moves.get((current_state, stack_top(current_stack)), ()):
+            new_config = (to, apply_transition(current_stack, expected_stack_top, stack_push))
+            if new_config in found:
+                continue
+            new_depth = depth(new_config[1])
+            if max_growth is not None and new_depth - base > max_growth:
+                budget["exceeded"] = f"stack grew by more than {max_growth} on epsilon moves"
+                continue
+            low = depth(current_stack) - (expected_stack_top != "epsilon" and current_stack is not None)
+            if new_depth > base and pop_bound is not None:
+                ancestor = pumps(found, new_config, config, low)
+                if ancestor is not None and same_top(new_config[1], ancestor[1], pop_bound):
+                    continue
+            if len(found) >= max_configs:
+                budget["exceeded"] = f"more than {max_configs} configurations"
+                budget["halt"] = True
+                return list(found)
+            found[new_config] = (config, base, low)
+            pending.append(new_config)
+
+    return list(found)
 
-    string = input("Enter the string to process (space-separated symbols): ")
-    symbols = string.split() if string.strip() else []
 
-    for symbol in symbols:
-        if symbol not in pda["symbols"]:
-            print(f"Error: Symbol '{symbol}' not recognized.")
-            return
+def next_states(pda, current_states_stacks, symbol):
+    moves = compile_pda(pda)["moves"]
+    next_states = []
+
+    for current_state, current_stack in current_states_stacks:
+        for to, expected_stack_top, stack_push in moves.get((current_state, stack_top(current_stack), symbol), ()):
+            next_states.append((to, apply_transition(current_stack, expected_stack_top, stack_push)))
+
+    return next_states
 
-    current_states_stacks = [(pda["init_state"], [])]
-    current_states_stacks = epsilon_closure(pda, current_states_stacks)
 
-    print(f"\nProcessing string: {symbols}")
-    print(f"Initial configuration: {current_states_stacks}")
+def run_deterministic(pda, symbols, verbose=False, max_moves=MAX_CONFIGS):
+    # Single-configuration engine for PDAs without conflicts: one mutable
+    # stack (top at the end) and one index lookup per move. Returns None if a
+    # chain of epsilon moves runs past max_moves, for the general engine to
+    # sort out.
+    moves, eps_moves = pda["moves"], pda["eps_moves"]
+    finals = set(pda["fin_states"])
+    state = pda["init_state"]
+    stack = []
+
+    def move(entry):
+        to, expected_stack_top, stack_push = entry
+        if expected_stack_top != "epsilon" and stack:
+            stack.pop()
+        if stack_push != ["epsilon"]:
+            stack.extend(reversed(stack_push))
+        return to
+
+    def settle():
+        # Follows epsilon moves; returns the first accepting (state, stack) on
+        # the way, (None, None) if there is none, or False if they never stop.
+        nonlocal state
+        snapshot = list if verbose else lambda stack: None
+        accepted = (state, snapshot(stack)) if state in finals else (None, None)
+        for _ in range(max_moves):
+            bucket = eps_moves.get((state, stack[-1] if stack else "epsilon"))
+            if not bucket:
+                return accepted
+            state = move(bucket[0])
+            if accepted[0] is None and state in finals:
+                accepted = (state, snapshot(stack))
+        return False
+
+    accepted = settle()
+    if accepted is False:
+        return None
+    if verbose:
+        print(f"\nProcessing string: {symbols}")
+        print(f"Initial configuration: {[(state, list(stack))]}")
 
+    for symbol in symbols:
+        bucket = moves.get((state, stack[-1] if stack else "epsilon", symbol))
+        if not bucket:
+            if verbose:
+                print(f"No transitions possible with symbol '{symbol}'")
+                print("REJECTED: No accepting configuration found")
+            return "REJECTED"
+        state = move(bucket[0])
+        accepted = settle()
+        if accepted is False:
+            return None
+        if verbose:
+            print(f"After '{symbol}': {[(state, list(stack))]}")
+
+    if accepted[0] is not None:
+        if verbose:
+            print(f"ACCEPTED: Final state {accepted[0]} with stack {accepted[1]}")
+        return "ACCEPTED"
+    if verbose:
+        print("REJECTED: No accepting configuration found")
+    return "REJECTED"
+
+
+def simulate(pda, symbols, verbose=False, max_configs=MAX_CONFIGS, depth_slack=DEPTH_SLACK):
+    # Returns "ACCEPTED", "REJECTED" or "BUDGET EXCEEDED"; the last one means a
+    # limit pruned the search and no accepting configuration was found.
+    pda = compile_pda(pda)
+    if pda["deterministic"]:
+        result = run_deterministic(pda, symbols, verbose, max_configs)
+        if result is not None:
+            return result
+        if verbose:
+            print("Epsilon moves did not settle; switching to the general engine.")
+    budget = {}
+    per_symbol = max(pda["max_push"], 1)
+
+    def closure(configs, remaining):
+        # Without popping epsilon moves, the remaining input pops at most `remaining` symbols.
+        return epsilon_closure(pda, configs, per_symbol * (remaining + 1) + depth_slack, max_configs, budget,
+                               None if pda["eps_pops"] else remaining)
+
+    current_states_stacks = closure([(pda["init_state"], None)], len(symbols))
+
+    if verbose:
+        print(f"\nProcessing string: {symbols}")
+        print(f"Initial configuration: {show(current_states_stacks)}")
+
+    halted = False
     for i, symbol in enumerate(symbols):
+        if budget.get("halt"):
+            # The configurations so far are incomplete; the rest of the input cannot be decided.
+            halted = True
+            break
         if not current_states_stacks:
-            print(f"No valid configurations after symbol '{symbol}'")
+            if verbose:
+                print(f"No valid configurations after symbol '{symbol}'")
             break
 
         next_configs = next_states(pda, current_states_stacks, symbol)
         if next_configs:
-            current_states_stacks = epsilon_closure(pda, next_configs)
-            print(f"After '{symbol}': {current_states_stacks}")
+            current_states_stacks = closure(next_configs, len(symbols) - i - 1)
+            if verbose:
+                print(f"After '{symbol}': {show(current_states_stacks)}")
         else:
             current_states_stacks = []
-            print(f"No transitions possible with symbol '{symbol}'")
+            if verbose:
+                print(f"No transitions possible with symbol '{symbol}'")
             break
 
-    accepted = False
-    if current_states_stacks:
+    if not halted:
         for state, stack in current_states_stacks:
             if state in pda["fin_states"]:
-                accepted = True
-                print(f"ACCEPTED: Final state {state} with stack {stack}")
-                break
-
-    if not accepted:
+                if verbose:
+                    print(f"ACCEPTED: Final state {state} with stack {stack_list(stack)}")
+                return "ACCEPTED"
+
+    if "exceeded" in budget:
+        if verbose:
+            print(f"BUDGET EXCEEDED: {budget['exceeded']}")
+        return "BUDGET EXCEEDED"
+    if verbose:
         print("REJECTED: No accepting configuration found")
+    return "REJECTED"
+
+
+def verdict(pda, symbols, **limits):
+    for symbol in symbols:
+        if symbol not in pda["symbols"]:
+            return "REJECTED"
+    return simulate(pda, symbols, **limits)
+
+
+def accepts(pda, symbols):
+    return verdict(pda, symbols) == "ACCEPTED"
+
+
+def build_pda(fpda):
+    pda = prep_pda(fpda)
+    if not pda or not check_pda(pda):
+        return None
+    return compile_pda(pda)
 
-    return accepted
 
+def load_pda(fpda):
+    return cache.load_cached(fpda, "pda", build_pda)
+
+
+def run_pda(fpda):
+    pda = load_pda(fpda)
+    if pda is None:
+        return None
+    print(f"Stack alphabet: {pda['stack']}")
+
+    print("PDA Transitions:")
+    for t in pda["transitions"]:
+        print(f"  {t[0]} & {t[1]} + {t[2]} > {t[3]}, {' '.join(t[4])}")
+    if pda["deterministic"]:
+        print("The PDA is deterministic; running a single configuration.")
+    else:
+        print(f"The PDA is nondeterministic at: {', '.join(conflicts(pda)[:5])}")
+
+    string = input("Enter the string to process (space-separated symbols): ")
+    symbols = string.split() if string.strip() else []
+
+    for symbol in symbols:
+        if symbol not in pda["symbols"]:
+            print(f"Error: Symbol '{symbol}' not recognized.")
+            return
+
+    # Stays boolean for callers; the verdict, including BUDGET EXCEEDED, is printed above.
+    return simulate(pda, symbols, verbose=True) == "ACCEPTED"
@@ -1,23 +1,59 @@
+class Line(str):
+    # A line of a definition file that remembers where it came from.
+    def __new__(cls, text, lineno):
+        line = str.__new__(cls, text)
+        line.lineno = lineno
+        return line
+
+
+def where(line):
+    lineno = getattr(line, "lineno", None)
+    return f" (line {lineno})" if lineno is not None else ""
+
+
+def _content(numbered):
+    for lineno, line in numbered:
+        line = line.strip()
+        if not line.startswith('#') and len(line) > 0:
+            yield lineno, line
+
+
+def _is_header(line):
+    return line[0] == '[' and line[-1] == ']'
+
+
+def _section_lines(content, name, start, next_header):
+    for lineno, line in content:
+        if line.upper() == "DONE":
+            return
+        if _is_header(line):
+            next_header.append((line[1:-1], lineno))
+            break
+        yield Line(line, lineno)
+    print(f"Warning: Section [{name}] starting at line {start} is missing DONE.")
+
+
+def iter_sections(fname):
+    # Yields (section name, lines) pairs while reading the file once. The lines
+    # come straight from the file, so a section must be consumed before the
+    # next one is requested; anything left unread is skipped.
+    with open(fname, 'r') as f:
+        content = _content(enumerate(f, start=1))
+        header = next(((line[1:-1], lineno) for lineno, line in content if _is_header(line)), None)
+        while header:
+            next_header = []
+            lines = _section_lines(content, header[0], header[1], next_header)
+            yield header[0], lines
+            for _ in lines:
+                pass
+            if next_header:
+                header = next_header[0]
+            else:
+                header = next(((line[1:-1], lineno) for lineno, line in content if _is_header(line)), None)
+
+
 def prep_file(fname):
-    f=open(fname,'r')
-    lines=f.readlines()
-    f.close()
-    cap={}
-    current_cap=None
-    current_lines=[]
-    for line in lines:
-        line=line.strip()
-        if not line.startswith('#') and len(line)>0:
-            if line[0]=='[' and line[-1]==']':
-                current_cap=line[1:-1]
-                current_lines=[]
-            elif line.upper()=="DONE" and current_cap:
-                if current_cap not in cap:
-                    cap[current_cap]=current_lines
-                else :
-                    cap[current_cap].append(current_lines)
-                current_lines=[]
-                current_cap=None
-            elif current_cap:
-                current_lines.append(line)
+    cap = {}
+    for name, lines in iter_sections(fname):
+        cap.setdefault(name, []).extend(lines)
     return cap
@@ -0,0 +1,130 @@
+import sys
+from collections import deque
+
+import dfa as dfa_module
+from dfa import DEAD
+
+OPERATIONS = {
+    "intersection": lambda x, y: x and y,
+    "union": lambda x, y: x or y,
+    "difference": lambda x, y: x and not y,
+    "xor": lambda x, y: x != y,
+}
+
+
+def _alphabet(a, b):
+    symbols = list(a["symbols"])
+    seen = set(symbols)
+    for symbol in b["symbols"]:
+        if symbol not in seen:
+            seen.add(symbol)
+            symbols.append(symbol)
+    return symbols
+
+
+def _can_accept(op, pa, pb):
+    # Pairs from which no word can reach an accepting pair are never expanded.
+    if op == "intersection":
+        return pa != DEAD and pb != DEAD
+    if op == "difference":
+        return pa != DEAD
+    return pa != DEAD or pb != DEAD
+
+
+def _explore(a, b, op, stop_early):
+    if op not in OPERATIONS:
+        raise ValueError(f"Unknown product operation '{op}'")
+    accept = OPERATIONS[op]
+    a, b = dfa_module.compile_dfa(a), dfa_module.compile_dfa(b)
+    symbols = _alphabet(a, b)
+
+    def accepting(pair):
+        pa, pb = pair
+        return accept(pa != DEAD and a["accepting"][pa] == 1, pb != DEAD and b["accepting"][pb] == 1)
+
+    start = (a["init"], b["init"])
+    parent = {start: None}
+    queue = deque([start])
+    transitions = []
+    while queue:
+        pair = queue.popleft()
+        if accepting(pair) and stop_early:
+            word = []
+            while parent[pair] is not None:
+                pair, symbol = parent[pair]
+                word.append(symbol)
+            word.reverse()
+            return word, parent, transitions
+        for symbol in symbols:
+            target = (dfa_module.step(a, pair[0], symbol), dfa_module.step(b, pair[1], symbol))
+            if not _can_accept(op, *target):
+                continue
+            if target not in parent:
+                parent[target] = (pair, symbol)
+                queue.append(target)
+            transitions.append((pair, symbol, target))
+    return None, parent, transitions
+
+
+def shortest_witness(a, b, op):
+    word, _, _ = _explore(a, b, op, stop_early=True)
+    return word
+
+
+def is_empty(a, b, op):
+    return shortest_witness(a, b, op) is None
+
+
+def equivalent(a, b):
+    word = shortest_witness(a, b, "xor")
+    return word is None, word
+
+
+def contains(a, b):
+    # Is the language of b a subset of the language of a?
+    word = shortest_witness(b, a, "difference")
+    return word is None, word
+
+
+def product(a, b, op):
+    _, parent, transitions = _explore(a, b, op, stop_early=False)
+    ca, cb = dfa_module.compile_dfa(a), dfa_module.compile_dfa(b)
+    accept = OPERATIONS[op]
+    names = {pair: f"q{i}" for i, pair in enumerate(parent)}
+    fin_states = [names[pair] for pair in parent
+                  if accept(pair[0] != DEAD and ca["accepting"][pair[0]] == 1,
+                            pair[1] != DEAD and cb["accepting"][pair[1]] == 1)]
+    return {
+        "symbols": _alphabet(a, b),
+        "states": list(names.values()),
+        "transitions": [(names[src], symbol, names[dst]) for src, symbol, dst in transitions],
+        "init_state": "q0",
+        "fin_states": fin_states,
+    }
+
+
+def intersection(a, b):
+    return product(a, b, "intersection")
+
+
+def union(a, b):
+    return product(a, b, "union")
+
+
+def difference(a, b):
+    return product(a, b, "difference")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python product.py first.abc second.abc")
+        sys.exit(2)
+    first, second = dfa_module.prep_dfa(sys.argv[1]), dfa_module.prep_dfa(sys.argv[2])
+    if first is None or second is None or not dfa_module.check_dfa(first) or not dfa_module.check_dfa(second):
+        sys.exit(1)
+    same, word = equivalent(first, second)
+    if same:
+        print("The DFAs accept the same language.")
+    else:
+        print(f"The DFAs differ on the string '{' '.join(word)}'.")
+    sys.exit(0 if same else 1)
@@ -1,4 +1,10 @@
+import time
+from array import array
+
+import cache
+import model
 import prep
+import validate
 
 
 def prep_band(fband):
@@ -13,8 +19,8 @@ def prep_states(fstate):
     states = []
     init_state = None
     fin_states = []
-    for state in fstate:
-        state = state.strip()
+    for line in fstate:
+        state = line.strip()
         if '-' in state:
             st, tip = state.split('-', maxsplit=1)
             states.append(st.strip())
@@ -22,7 +28,7 @@ def prep_states(fstate):
                 if init_state is None:
                     init_state = st.strip()
                 else:
-                    print(f"Error: Multiple initial states found: {init_state} and {st}.")
+                    print(f"Error: Multiple initial states found: {init_state} and {st}{prep.where(line)}.")
                     return None, None, None
             elif tip == 'accept':
                 fin_states.append(st.strip())
@@ -41,55 +47,66 @@ def prep_symbols(fsymbols):
     return symbols if symbols else None
 
 
-def prep_transitions(ftransitions):
-    transitions = []
+def prep_transitions(ftransitions, turing=None):
+    if turing is None:
+        turing = model.Automaton("tm")
+    turing.setdefault("transitions", [])
     for transition in ftransitions:
         try:
             inp, rez = transition.split('>')
             in_state, symbol = inp.split('&')
             parts = rez.split(',')
             if len(parts) != 3:
-                print(f"Error: Transition must have format: state & symbol > next_state, write, direction")
+                print(f"Error: Transition must have format: state & symbol > next_state, write, direction{prep.where(transition)}")
                 return None
             next_state, write_symbol, turn = parts
-            transitions.append((
+            turing.add_transition((
                 in_state.strip(),
                 symbol.strip(),
                 next_state.strip(),
                 write_symbol.strip(),
                 turn.strip()
-            ))
+            ), getattr(transition, "lineno", 0))
         except ValueError:
-            print(f"Error: Invalid transition format: {transition}")
+            print(f"Error: Invalid transition format: {transition}{prep.where(transition)}")
             return None
-    return transitions
+    return turing["transitions"]
 
 
 def prep_turing(fturing):
-    files = prep.prep_file(fturing)
-    if not files:
+    turing = model.Automaton("tm")
+    files = {}
+    for cap, lines in prep.iter_sections(fturing):
+        if cap.upper() == "TRANSITIONS":
+            if prep_transitions(lines, turing) is None:
+                return None
+        elif cap.upper() == "BAND":
+            turing["band"] = turing.get("band", []) + prep_band(lines)
+        else:
+            files.setdefault(cap, []).extend(lines)
+    if not files and not turing:
         print("Error: No data found in the file.")
         return None
-    turing = {}
+    if "band" in turing and not turing["band"]:
+        print("Error: Band cannot be empty.")
+        return None
     for cap in files.keys():
         if cap.upper() == "SYMBOLS":
-            turing["symbols"] = prep_symbols(files[cap])
-            if turing["symbols"] is None:
+            symbols = prep_symbols(files[cap])
+            if symbols is None:
                 return None
+            turing["symbols"] = symbols
         elif cap.upper() == "STATES":
             result = prep_states(files[cap])
             if result[0] is None:
                 return None
             turing["states"], turing["init_state"], turing["fin_states"] = result
-        elif cap.upper() == "TRANSITIONS":
-            turing["transitions"] = prep_transitions(files[cap])
-            if turing["transitions"] is None:
-                return None
-        elif cap.upper() == "BAND":
-            turing["band"] = prep_band(files[cap])
-            if not turing["band"]:
-                print("Error: Band cannot be empty.")
+        elif cap.upper() == "BLANK":
+            blank = prep_band(files[cap])
+            if len(blank) != 1:
+                print(f"Error: The blank section must hold exactly one symbol{prep.where(files[cap][0]) if files[cap] else ''}.")
                 return None
+            turing["blank"] = blank[0]
     return turing
 
 
@@ -100,53 +117,273 @@ def find_transition(turing, current_state, symbol):
     return None
 
 
-def run_tm(ftm):
-    turing = prep_turing(ftm)
-    if not turing:
-        return None, None
+BLANK = "_"
 
-    current_state = turing["init_state"]
-    current_band = turing["band"].copy()
-    pos = 0
-    steps = 0
-    max_steps = 1000
 
-    print(f"Initial state: {current_state}")
-    print(f"Initial band: {current_band}")
-    print(f"Accept states: {turing['fin_states']}")
+class Tape:
+    # A tape without ends. Cells hold interned symbol ids in a bytearray (an
+    # array('I') once there are more than 256 symbols) and the blank is id 0,
+    # so growing either side is padding with zeros. The buffer at least doubles
+    # each time, which keeps growth amortized O(1). Positions are relative to
+    # the first cell of the initial band and may go negative.
+    __slots__ = ("table", "cells", "origin", "low", "high")
+
+    def __init__(self, band=(), blank=BLANK, table=None):
+        # `table` seeds the symbol ids (its first name is the blank); it is copied.
+        self.table = model.SymbolTable()
+        for name in table.names if table is not None else (blank,):
+            self.table.intern(name)
+        size = max(len(band), 1)
+        self.cells = bytearray(size) if len(self.table) <= 256 else array('I', bytes(4 * size))
+        self.origin = 0
+        self.low = 0
+        self.high = len(band) - 1
+        for pos, symbol in enumerate(band):
+            self[pos] = symbol
+
+    def _zeros(self, n):
+        return bytearray(n) if isinstance(self.cells, bytearray) else array('I', bytes(4 * n))
+
+    def __getitem__(self, pos):
+        i = pos + self.origin
+        if 0 <= i < len(self.cells):
+            return self.table.names[self.cells[i]]
+        return self.table.names[0]
+
+    def __setitem__(self, pos, symbol):
+        value = self.table.index.get(symbol)
+        if value is None:
+            value = self.table.intern(symbol)
+        self.put(pos, value)
+
+    def put(self, pos, value):
+        if value > 255 and isinstance(self.cells, bytearray):
+            self.cells = array('I', list(self.cells))
+        i = pos + self.origin
+        if not 0 <= i < len(self.cells):
+            i = self._grow(i)
+        self.cells[i] = value
+        if pos < self.low:
+            self.low = pos
+        elif pos > self.high:
+            self.high = pos
+
+    def _grow(self, i):
+        # Makes room for buffer index i and returns where that cell ended up.
+        if i < 0:
+            pad = max(len(self.cells), -i)
+            self.cells = self._zeros(pad) + self.cells
+            self.origin += pad
+            return i + pad
+        self.cells += self._zeros(max(len(self.cells), i + 1 - len(self.cells)))
+        return i
+
+    def __len__(self):
+        return self.high - self.low + 1
+
+    def symbols(self, low=None, high=None):
+        low = self.low if low is None else low
+        high = self.high if high is None else high
+        return [self[pos] for pos in range(low, high + 1)]
+
+    def __str__(self):
+        return "".join(self.symbols())
+
+    def snapshot(self):
+        # The written cells without blanks at either end, and where they start;
+        # equal snapshots mean equal tapes.
+        ids = self.cells[self.low + self.origin:self.high + self.origin + 1]
+        first, last = 0, len(ids)
+        while first < last and not ids[first]:
+            first += 1
+        while last > first and not ids[last - 1]:
+            last -= 1
+        ids = ids[first:last]
+        return self.low + first if ids else 0, bytes(ids) if isinstance(ids, bytearray) else ids.tobytes()
+
+    def window(self, pos, radius):
+        return "".join(self.symbols(max(self.low, pos - radius), min(self.high, pos + radius)))
 
-    while current_state not in turing["fin_states"] and steps < max_steps:
 
-        symbol = current_band[pos]
-        transition = find_transition(turing, current_state, symbol)
+MOVES = {"L": -1, "R": 1, "S": 0}
+MAX_STEPS = 1000
+TIME_CHECK_EVERY = 4096
+HASH_MASK = (1 << 64) - 1
+TRACE_LEVELS = ("none", "summary", "every", "window")
 
-        if transition is None:
-            print(f"No transition found for state '{current_state}' and symbol '{symbol}'")
-            print("REJECTED")
-            return current_band, current_state
 
-        _, _, next_state, write_symbol, turn = transition
+def compile_turing(turing, blank=None):
+    # (state, symbol id) -> (next_state, write id, head move) over a symbol
+    # table that starts with the blank, so the step loop works on tape ids
+    # directly. The first transition for a pair wins, as in find_transition;
+    # an invalid direction is kept as None and reported when it is taken.
+    blank = blank if blank is not None else turing.get("blank", BLANK)
+    if "actions" in turing and turing["tape_symbols"].names[0] == blank:
+        return turing
+    table = model.SymbolTable()
+    table.intern(blank)
+    for symbol in turing["symbols"]:
+        table.intern(symbol)
+    actions = {}
+    for in_state, symbol, next_state, write_symbol, turn in turing["transitions"]:
+        key = (in_state, table.intern(symbol))
+        if key not in actions:
+            actions[key] = (next_state, table.intern(write_symbol), MOVES.get(turn))
+    compiled = dict(turing)
+    compiled["tape_symbols"] = table
+    compiled["actions"] = actions
+    compiled["finals"] = set(turing["fin_states"])
+    return compiled
 
-        current_band[pos] = write_symbol
 
-        current_state = next_state
+def cell_hash(pos, value):
+    # Blank cells add nothing, so the tape hash does not depend on how far the
+    # tape has grown.
+    return hash((pos, value)) & HASH_MASK if value else 0
 
-        if turn == 'R':
-            pos += 1
-        elif turn == 'L':
-            pos -= 1
-        elif turn == 'S':
-            pass
+
+def simulate(turing, band, max_steps=MAX_STEPS, verbose=False, blank=None, trace=None, trace_every=None,
+             trace_window=20, max_time=None, detect_loops=False):
+    # Verdicts: ACCEPTED, REJECTED, TIMEOUT (max_steps steps or max_time
+    # seconds; None means no limit), LOOPING (with detect_loops, the machine
+    # came back to an earlier configuration) or ERROR.
+    # trace: "none"; "summary" (one line at the end); "every" (a status line
+    # every trace_every steps, default 1000); "window" (the tape within
+    # trace_window cells of the head every trace_every steps, default 1).
+    # verbose alone means "window".
+    trace = trace or ("window" if verbose else "none")
+    if trace not in TRACE_LEVELS:
+        print(f"Error: Unknown trace level '{trace}'.")
+        return None, None, "ERROR"
+    trace_every = trace_every or (1000 if trace == "every" else 1)
+    turing = compile_turing(turing, blank)
+    actions, finals = turing["actions"], turing["finals"]
+    tape = Tape(band, table=turing["tape_symbols"])
+    state = turing["init_state"]
+    pos = steps = 0
+    low, high = tape.low, tape.high
+    cells, origin = tape.cells, tape.origin
+    limit = -1 if max_steps is None else max_steps
+    never = float("inf")
+    report = trace_every if trace in ("every", "window") else never
+    clock = TIME_CHECK_EVERY if max_time is not None else never
+    next_event = min(report, clock)
+    started = time.perf_counter()
+    reason = None
+
+    # Brent's cycle detection: the configuration at each power-of-two step is
+    # saved, and every later one is compared with it until the next power of
+    # two. Configurations are compared by (state, head, incremental tape
+    # hash); a match is confirmed against the saved tape before reporting.
+    tape_hash = 0
+    if detect_loops:
+        for p in range(low, high + 1):
+            tape_hash = (tape_hash + cell_hash(p, cells[p + origin])) & HASH_MASK
+        saved = (state, pos, tape_hash, tape.snapshot())
+        power, lam = 1, 0
+
+    def show():
+        tape.low, tape.high = low, high
+        if trace == "window":
+            print(f"Step {steps}: State={state}, Pos={pos}, Band={tape.window(pos, trace_window)}")
         else:
-            print(f"Error: Invalid turn direction '{turn}'.")
-            return None, None
+            print(f"Step {steps}: State={state}, Pos={pos}, Tape cells={len(tape)}")
 
+    verdict = None
+    while state not in finals and steps != limit:
+        i = pos + origin
+        symbol = cells[i] if 0 <= i < len(cells) else 0
+        action = actions.get((state, symbol))
+        if action is None:
+            verdict = "REJECTED"
+            break
+        state, write, move = action
+        if move is None:
+            print(f"Error: Invalid turn direction in a transition to '{state}'.")
+            return None, None, "ERROR"
+        if 0 <= i < len(cells):
+            cells[i] = write
+        else:
+            tape.put(pos, write)
+            cells, origin = tape.cells, tape.origin
+        if pos < low:
+            low = pos
+        elif pos > high:
+            high = pos
+        if detect_loops and write != symbol:
+            tape_hash = (tape_hash + cell_hash(pos, write) - cell_hash(pos, symbol)) & HASH_MASK
+        pos += move
         steps += 1
-        print(f"Step {steps}: State={current_state}, Pos={pos}, Band={''.join(current_band)}")
 
-    if current_state in turing["fin_states"]:
-        print("ACCEPTED")
-    else:
-        print(f"TIMEOUT after {steps} steps")
+        if detect_loops:
+            if state == saved[0] and pos == saved[1] and tape_hash == saved[2]:
+                tape.low, tape.high = low, high
+                if tape.snapshot() == saved[3]:
+                    verdict = "LOOPING"
+                    reason = f"after {steps} steps: the configuration repeats every {lam + 1} steps"
+                    break
+            lam += 1
+            if lam == power:
+                tape.low, tape.high = low, high
+                saved = (state, pos, tape_hash, tape.snapshot())
+                power *= 2
+                lam = 0
+
+        if steps == next_event:
+            if steps == report:
+                show()
+                report += trace_every
+            if steps == clock:
+                if time.perf_counter() - started > max_time:
+                    verdict = "TIMEOUT"
+                    reason = f"after {max_time}s ({steps} steps)"
+                    break
+                clock += TIME_CHECK_EVERY
+            next_event = min(report, clock)
+    tape.low, tape.high = low, high
+
+    if verdict is None:
+        verdict = "ACCEPTED" if state in finals else "TIMEOUT"
+        if verdict == "TIMEOUT":
+            reason = f"after {steps} steps"
+    if verbose:
+        if verdict == "REJECTED":
+            print(f"No transition found for state '{state}' and symbol '{tape[pos]}'")
+        print(f"{verdict} {reason}" if reason else verdict)
+    if trace == "summary":
+        elapsed = time.perf_counter() - started
+        rate = f"{steps / elapsed:,.0f} steps/s" if elapsed > 0 else "instant"
+        print(f"{verdict} after {steps} steps in {elapsed:.3f}s ({rate}); state {state}, {len(tape)} tape cells")
+
+    return tape.symbols(), state, verdict
+
+
+def check_turing(turing):
+    return validate.check(turing, "tm")
+
+
+def build_turing(ftm):
+    turing = prep_turing(ftm)
+    if not turing or not check_turing(turing):
+        return None
+    return compile_turing(turing)
+
+
+def load_turing(ftm):
+    return cache.load_cached(ftm, "tm", build_turing)
+
+
+def run_tm(ftm, max_steps=MAX_STEPS, max_time=None, detect_loops=False, trace="window", trace_every=None,
+           trace_window=20):
+    turing = load_turing(ftm)
+    if not turing:
+        return None, None
+
+    print(f"Initial state: {turing['init_state']}")
+    print(f"Initial band: {turing['band']}")
+    print(f"Accept states: {turing['fin_states']}")
 
+    current_band, current_state, _ = simulate(turing, turing["band"], max_steps=max_steps, verbose=True, trace=trace,
+                                              trace_every=trace_every, trace_window=trace_window,
+                                              max_time=max_time, detect_loops=detect_loops)
     return current_band, current_state
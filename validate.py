@@ -0,0 +1,130 @@
+# One validator for every machine type. The alphabets are turned into sets once
+# and every transition is visited a single time; problems are collected rather
+# than stopping at the first one, each as (severity, line number, message).
+
+from itertools import islice
+
+MISSING_EXAMPLES = 5
+REQUIRED = {
+    "dfa": ("states", "symbols", "transitions"),
+    "nfa": ("states", "symbols", "transitions"),
+    "pda": ("states", "symbols", "stack", "transitions"),
+    "tm": ("states", "symbols", "transitions"),
+}
+DIRECTIONS = {"L", "R", "S"}
+
+
+def validate(machine, kind):
+    problems = []
+
+    def error(message, lineno=None):
+        problems.append(("Error", lineno, message))
+
+    def warning(message, lineno=None):
+        problems.append(("Warning", lineno, message))
+
+    missing = [key for key in REQUIRED[kind] if key not in machine]
+    if missing:
+        error(f"Missing section(s): {', '.join(missing)}")
+        return problems
+
+    states = set(machine["states"])
+    symbols = set(machine["symbols"])
+    stack = set(machine.get("stack") or ())
+    if machine.get("init_state") not in states:
+        error(f"Initial state {machine.get('init_state')} is not a declared state")
+    for state in machine.get("fin_states", ()):
+        if state not in states:
+            error(f"Accept state {state} is not a declared state")
+    if kind == "tm" and "blank" in machine and machine["blank"] not in symbols:
+        warning(f"Blank symbol {machine['blank']} is not a declared symbol, so no transition can read it")
+
+    lines = machine.get("transition_lines")
+    seen = {}
+    for i, t in enumerate(machine["transitions"]):
+        lineno = lines[i] if lines is not None and i < len(lines) and lines[i] else None
+        if kind in ("dfa", "nfa"):
+            source, symbol, target = t
+            key = (source, symbol)
+            if symbol not in symbols:
+                error(f"Transition with non-existing symbol {symbol}", lineno)
+        elif kind == "pda":
+            source, top, symbol, target, push = t
+            key = (source, top, symbol)
+            if top not in stack and top != "epsilon":
+                error(f"Transition with non-existing stack top {top}", lineno)
+            if symbol not in symbols and symbol != "epsilon":
+                error(f"Transition with non-existing symbol {symbol}", lineno)
+            for s in push:
+                if s not in stack and s != "epsilon":
+                    error(f"Transition with non-existing stack push {s}", lineno)
+            target = (target, tuple(push))
+        else:
+            source, symbol, target, write, turn = t
+            key = (source, symbol)
+            if symbol not in symbols:
+                error(f"Transition reading non-existing symbol {symbol}", lineno)
+            if write not in symbols:
+                error(f"Transition writing non-existing symbol {write}", lineno)
+            if turn not in DIRECTIONS:
+                error(f"Invalid turn direction '{turn}'", lineno)
+            target = (target, write, turn)
+
+        if source not in states:
+            error(f"Transition from non-existing state {source}", lineno)
+        next_state = target[0] if isinstance(target, tuple) else target
+        if next_state not in states:
+            error(f"Transition to non-existing state {next_state}", lineno)
+
+        if kind in ("dfa", "tm"):
+            first = seen.get(key)
+            if first is None:
+                seen[key] = (target, lineno)
+            elif first[0] == target:
+                warning(f"Duplicate transition {_describe(kind, key)}{_first(first[1])}", lineno)
+            else:
+                warning(f"Non-deterministic transition {_describe(kind, key)}{_first(first[1])}; "
+                        f"only the first one is ever used", lineno)
+        else:
+            full = (key, target)
+            if full in seen:
+                warning(f"Duplicate transition {_describe(kind, key)}{_first(seen[full])}", lineno)
+            else:
+                seen[full] = lineno
+
+    if kind == "dfa":
+        # Count the gaps instead of listing them; only the first few are named.
+        covered = sum(1 for state, symbol in seen if state in states and symbol in symbols)
+        gaps = len(states) * len(symbols) - covered
+        if gaps:
+            first = islice(((state, symbol) for state in machine["states"] for symbol in machine["symbols"]
+                            if (state, symbol) not in seen), MISSING_EXAMPLES)
+            examples = ", ".join(f"{state} + {symbol}" for state, symbol in first)
+            more = ", ..." if gaps > MISSING_EXAMPLES else ""
+            warning(f"{gaps} missing transition(s), the DFA rejects there: {examples}{more}")
+    return problems
+
+
+def _describe(kind, key):
+    if kind == "pda":
+        return f"{key[0]} & {key[1]} + {key[2]}"
+    if kind == "tm":
+        return f"{key[0]} & {key[1]}"
+    return f"{key[0]} + {key[1]}"
+
+
+def _first(lineno):
+    return f" (first defined on line {lineno})" if lineno else ""
+
+
+def report(problems):
+    for severity, lineno, message in problems:
+        where = f" (line {lineno})" if lineno else ""
+        print(f"{severity}: {message}{where}.")
+    return not any(severity == "Error" for severity, _, _ in problems)
+
+
+def check(machine, kind):
+    if machine.get("validated"):
+        return True
+    return report(validate(machine, kind))